@@ -0,0 +1,37 @@
+"""add shopify active merchant index
+
+Revision ID: 3f1c9a7d2b64
+Revises: 
+Create Date: 2026-10-15 09:12:41.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7d2b64'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Built without locking merchants against writes; CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_merchants_shopify_active', 'merchants', ['shopify_shop_domain'],
+            if_not_exists=True,
+            postgresql_where=sa.text("platform_type = 'shopify' AND is_active = true"),
+            postgresql_include=['shopify_webhook_secret'],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_merchants_shopify_active', table_name='merchants',
+            if_exists=True,
+            postgresql_concurrently=True
+        )
@@ -0,0 +1,53 @@
+"""add unique shopify shop domain
+
+Revision ID: 8a2e5c41f0d7
+Revises: 3f1c9a7d2b64
+Create Date: 2026-10-15 09:40:03.552871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a2e5c41f0d7'
+down_revision = '3f1c9a7d2b64'
+branch_labels = None
+depends_on = None
+
+
+# Tables whose rows belong to a merchant; duplicates' rows move to the merchant that is kept
+MERCHANT_CHILD_TABLES = ('customers', 'conversations', 'orders', 'webhook_events', 'audit_logs')
+
+
+def upgrade() -> None:
+    # Keep one merchant per shop (active first, then most recently updated)
+    op.execute("""
+        CREATE TEMPORARY TABLE merchant_duplicates AS
+        SELECT id, keep_id FROM (
+            SELECT id, first_value(id) OVER (
+                PARTITION BY shopify_shop_domain, platform_type
+                ORDER BY is_active DESC NULLS LAST, updated_at DESC NULLS LAST, id DESC
+            ) AS keep_id
+            FROM merchants
+            WHERE shopify_shop_domain IS NOT NULL
+        ) ranked
+        WHERE id <> keep_id
+    """)
+    for table in MERCHANT_CHILD_TABLES:
+        op.execute(f"""
+            UPDATE {table} SET merchant_id = d.keep_id
+            FROM merchant_duplicates d
+            WHERE {table}.merchant_id = d.id
+        """)
+    op.execute("DELETE FROM merchants USING merchant_duplicates d WHERE merchants.id = d.id")
+    op.execute("DROP TABLE merchant_duplicates")
+    
+    op.create_unique_constraint(
+        'uq_merchants_shopify_shop_domain', 'merchants', ['shopify_shop_domain', 'platform_type']
+    )
+
+
+def downgrade() -> None:
+    # Merged duplicate merchants are not restored
+    op.drop_constraint('uq_merchants_shopify_shop_domain', 'merchants', type_='unique')
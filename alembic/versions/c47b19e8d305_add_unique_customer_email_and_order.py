@@ -0,0 +1,83 @@
+"""add unique customer email and order
+
+Revision ID: c47b19e8d305
+Revises: 8a2e5c41f0d7
+Create Date: 2026-10-15 10:05:27.904116
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47b19e8d305'
+down_revision = '8a2e5c41f0d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Keep the oldest customer per (merchant, email), preferring one with a platform ID
+    op.execute("""
+        CREATE TEMPORARY TABLE customer_duplicates AS
+        SELECT id, keep_id FROM (
+            SELECT id, first_value(id) OVER (
+                PARTITION BY merchant_id, email
+                ORDER BY (external_id IS NULL OR external_id = ''), id
+            ) AS keep_id
+            FROM customers
+            WHERE email IS NOT NULL
+        ) ranked
+        WHERE id <> keep_id
+    """)
+    # Carry over identifiers the kept row is missing, so WhatsApp and platform links survive
+    op.execute("""
+        UPDATE customers SET
+            external_id = COALESCE(NULLIF(customers.external_id, ''), merged.external_id),
+            whatsapp_id = COALESCE(customers.whatsapp_id, merged.whatsapp_id),
+            phone_number = COALESCE(customers.phone_number, merged.phone_number)
+        FROM (
+            SELECT d.keep_id,
+                   max(NULLIF(c.external_id, '')) AS external_id,
+                   max(c.whatsapp_id) AS whatsapp_id,
+                   max(c.phone_number) AS phone_number
+            FROM customer_duplicates d
+            JOIN customers c ON c.id = d.id
+            GROUP BY d.keep_id
+        ) merged
+        WHERE customers.id = merged.keep_id
+    """)
+    for table in ('conversations', 'orders'):
+        op.execute(f"""
+            UPDATE {table} SET customer_id = d.keep_id
+            FROM customer_duplicates d
+            WHERE {table}.customer_id = d.id
+        """)
+    op.execute("DELETE FROM customers USING customer_duplicates d WHERE customers.id = d.id")
+    op.execute("DROP TABLE customer_duplicates")
+    
+    op.create_unique_constraint('uq_customers_merchant_email', 'customers', ['merchant_id', 'email'])
+    
+    # Redelivered order webhooks may have stored an order twice; keep the most recently updated copy
+    op.execute("""
+        DELETE FROM orders USING (
+            SELECT id, row_number() OVER (
+                PARTITION BY merchant_id, external_order_id
+                ORDER BY updated_at DESC NULLS LAST, id DESC
+            ) AS position
+            FROM orders
+            WHERE external_order_id IS NOT NULL
+        ) ranked
+        WHERE orders.id = ranked.id AND ranked.position > 1
+    """)
+    
+    # The unique constraint's index replaces the plain lookup index
+    op.drop_index('ix_orders_merchant_external', table_name='orders', if_exists=True)
+    op.create_unique_constraint('uq_orders_merchant_external', 'orders', ['merchant_id', 'external_order_id'])
+
+
+def downgrade() -> None:
+    # Merged duplicate customers and orders are not restored
+    op.drop_constraint('uq_orders_merchant_external', 'orders', type_='unique')
+    op.create_index('ix_orders_merchant_external', 'orders', ['merchant_id', 'external_order_id'])
+    op.drop_constraint('uq_customers_merchant_email', 'customers', type_='unique')
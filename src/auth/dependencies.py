@@ -162,7 +162,7 @@ async def get_optional_user(
     """Get user if authenticated, but don't require authentication"""
     try:
         return await get_current_user_or_api_key(request, db, credentials)
-    except:
+    except Exception:
         return None
 
 
@@ -1,44 +1,84 @@
-import json
+import orjson
 import redis.asyncio as redis
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, List, Tuple
 from datetime import datetime, timedelta
+import fnmatch
 import random
+import time
+from cachetools import TLRUCache
 from loguru import logger
 
 from .config import settings
 
 
+# Token bucket with lazy refill, evaluated atomically in Redis.
+# KEYS[1] = bucket key; ARGV = now_ms, refill rate (tokens/ms), capacity.
+# Returns {allowed (0/1), retry_after_ms}.
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = math.ceil((1 - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate))
+return {allowed, wait}
+"""
+
+# Fixed-window counter: the first increment starts the window (Redis 6 has no EXPIRE NX).
+# KEYS[1] = counter key; ARGV[1] = window seconds. Returns the new count.
+INCR_EXPIRE_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return count
+"""
+
+
 class CacheService:
+    # TTL strategies with jitter
+    TTL_OAUTH = 1800       # 30 minutes
+    TTL_SESSION = 86400    # 24 hours  
+    TTL_CONVERSATION = 7200  # 2 hours
+    TTL_ORDER_CACHE = 300   # 5 minutes
+    TTL_SHORT = 60         # 1 minute
+    
     def __init__(self):
-        self.redis = redis.from_url(settings.redis_url, decode_responses=True)
-        
-        # TTL strategies with jitter
-        self.TTL_OAUTH = 1800       # 30 minutes
-        self.TTL_SESSION = 86400    # 24 hours  
-        self.TTL_CONVERSATION = 7200  # 2 hours
-        self.TTL_ORDER_CACHE = 300   # 5 minutes
-        self.TTL_SHORT = 60         # 1 minute
+        self.redis = redis.from_url(settings.redis_url)
+        self._token_bucket = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self._incr_expire = self.redis.register_script(INCR_EXPIRE_SCRIPT)
     
     async def get(self, key: str) -> Optional[Any]:
         """Get value from cache"""
         try:
             value = await self.redis.get(key)
             if value:
-                return json.loads(value)
+                return orjson.loads(value)
             return None
-        except (redis.RedisError, json.JSONDecodeError) as e:
+        except (redis.RedisError, orjson.JSONDecodeError) as e:
             logger.error(f"Cache get error for key {key}: {e}")
             return None
     
     async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
         """Set value in cache with optional TTL"""
         try:
-            serialized_value = json.dumps(value, default=str)
+            serialized_value = orjson.dumps(value, default=str)
             if ttl:
                 return await self.redis.setex(key, ttl, serialized_value)
             else:
                 return await self.redis.set(key, serialized_value)
-        except (redis.RedisError, json.JSONEncodeError) as e:
+        except (redis.RedisError, orjson.JSONEncodeError) as e:
             logger.error(f"Cache set error for key {key}: {e}")
             return False
     
@@ -52,6 +92,33 @@ class CacheService:
             logger.error(f"Cache with jitter error for key {key}: {e}")
             return False
     
+    async def mget(self, keys: List[str]) -> List[Optional[Any]]:
+        """Get multiple values from cache in a single round trip"""
+        if not keys:
+            return []
+        try:
+            values = await self.redis.mget(keys)
+            return [orjson.loads(value) if value else None for value in values]
+        except (redis.RedisError, orjson.JSONDecodeError) as e:
+            logger.error(f"Cache mget error for {len(keys)} keys: {e}")
+            return [None] * len(keys)
+    
+    async def mset(self, items: Dict[str, Any], base_ttl: int) -> bool:
+        """Set multiple values with jittered TTLs in a single pipeline"""
+        if not items:
+            return True
+        try:
+            jitter = int(base_ttl * 0.1)
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, value in items.items():
+                    ttl = base_ttl + random.randint(-jitter, jitter)
+                    pipe.setex(key, ttl, orjson.dumps(value, default=str))
+                await pipe.execute()
+            return True
+        except (redis.RedisError, orjson.JSONEncodeError) as e:
+            logger.error(f"Cache mset error for {len(items)} keys: {e}")
+            return False
+    
     async def delete(self, key: str) -> bool:
         """Delete key from cache"""
         try:
@@ -88,6 +155,14 @@ class CacheService:
             logger.error(f"Cache exists check error for key {key}: {e}")
             return False
     
+    async def ttl(self, key: str) -> int:
+        """Seconds until key expires; -1 without expiry, -2 if missing"""
+        try:
+            return await self.redis.ttl(key)
+        except redis.RedisError as e:
+            logger.error(f"Cache ttl error for key {key}: {e}")
+            return -2
+    
     async def increment(self, key: str, amount: int = 1) -> Optional[int]:
         """Increment counter"""
         try:
@@ -96,14 +171,54 @@ class CacheService:
             logger.error(f"Cache increment error for key {key}: {e}")
             return None
     
+    async def increment_with_expire(self, key: str, seconds: int) -> Optional[int]:
+        """Increment counter, starting its expiry window on the first increment"""
+        try:
+            return await self._incr_expire(keys=[key], args=[seconds])
+        except redis.RedisError as e:
+            logger.error(f"Cache increment error for key {key}: {e}")
+            return None
+    
     async def set_with_expire(self, key: str, value: Any, seconds: int) -> bool:
         """Set key with expiration time"""
         try:
-            return await self.redis.setex(key, seconds, json.dumps(value, default=str))
-        except (redis.RedisError, json.JSONEncodeError) as e:
+            return await self.redis.setex(key, seconds, orjson.dumps(value, default=str))
+        except (redis.RedisError, orjson.JSONEncodeError) as e:
             logger.error(f"Cache setex error for key {key}: {e}")
             return False
     
+    async def acquire_lock(self, key: str, seconds: int) -> bool:
+        """Take a short-lived lock (SET NX EX); True if this caller now holds it"""
+        try:
+            return bool(await self.redis.set(key, b"1", nx=True, ex=seconds))
+        except redis.RedisError as e:
+            logger.error(f"Cache lock error for key {key}: {e}")
+            return True
+    
+    async def get_with_etag(self, key: str) -> Tuple[Optional[str], Optional[Any]]:
+        """Get the last known (etag, body) validator pair for key"""
+        entry = await self.get(f"etag:{key}")
+        if not entry:
+            return None, None
+        return entry[0], entry[1]
+    
+    async def set_with_etag(self, key: str, etag: str, value: Any, ttl: Optional[int] = None) -> bool:
+        """Store an (etag, body) validator pair that outlives the fresh cache entry"""
+        return await self.set(f"etag:{key}", (etag, value), ttl or self.TTL_SESSION)
+    
+    async def eval_rate_script(self, key: str, calls: int, window: int) -> Tuple[bool, int]:
+        """Take one token from a bucket allowing `calls` per `window` seconds; returns (allowed, retry_after_ms)"""
+        try:
+            allowed, retry_after_ms = await self._token_bucket(
+                keys=[key],
+                args=[int(time.time() * 1000), calls / (window * 1000), calls]
+            )
+            return bool(allowed), int(retry_after_ms)
+        except redis.RedisError as e:
+            # Fail open: rate limiting is a courtesy to the upstream, not a hard guarantee
+            logger.error(f"Rate limit script error for key {key}: {e}")
+            return True, 0
+    
     async def get_or_set(self, key: str, value_func, ttl: int) -> Any:
         """Get from cache or set if not exists"""
         cached_value = await self.get(key)
@@ -131,6 +246,114 @@ class CacheService:
             logger.error(f"Error closing Redis connection: {e}")
 
 
+class MemoryCacheService(CacheService):
+    """In-process cache with the CacheService surface, for running without Redis (CACHE_BACKEND=memory)"""
+    
+    def __init__(self):
+        self.redis = None
+        # Entries are (monotonic deadline, serialized value); no awaits inside, so no lock is needed
+        self._store = TLRUCache(maxsize=10_000, ttu=lambda key, entry, now: entry[0])
+    
+    def _put(self, key: str, value: Any, ttl: Optional[int]) -> None:
+        deadline = time.monotonic() + ttl if ttl else float("inf")
+        self._store[key] = (deadline, orjson.dumps(value, default=str))
+    
+    async def get(self, key: str) -> Optional[Any]:
+        """Get value from cache"""
+        entry = self._store.get(key)
+        return orjson.loads(entry[1]) if entry else None
+    
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
+        """Set value in cache with optional TTL"""
+        try:
+            self._put(key, value, ttl)
+            return True
+        except orjson.JSONEncodeError as e:
+            logger.error(f"Cache set error for key {key}: {e}")
+            return False
+    
+    async def mget(self, keys: List[str]) -> List[Optional[Any]]:
+        """Get multiple values from cache"""
+        return [await self.get(key) for key in keys]
+    
+    async def mset(self, items: Dict[str, Any], base_ttl: int) -> bool:
+        """Set multiple values with jittered TTLs"""
+        jitter = int(base_ttl * 0.1)
+        for key, value in items.items():
+            self._put(key, value, base_ttl + random.randint(-jitter, jitter))
+        return True
+    
+    async def delete(self, key: str) -> bool:
+        """Delete key from cache"""
+        return self._store.pop(key, None) is not None
+    
+    async def invalidate_pattern(self, pattern: str) -> int:
+        """Delete all keys matching pattern"""
+        keys = [key for key in list(self._store.keys()) if fnmatch.fnmatchcase(key, pattern)]
+        for key in keys:
+            self._store.pop(key, None)
+        return len(keys)
+    
+    async def exists(self, key: str) -> bool:
+        """Check if key exists in cache"""
+        return key in self._store
+    
+    async def ttl(self, key: str) -> int:
+        """Seconds until key expires; -1 without expiry, -2 if missing"""
+        entry = self._store.get(key)
+        if entry is None:
+            return -2
+        if entry[0] == float("inf"):
+            return -1
+        return max(0, int(entry[0] - time.monotonic()))
+    
+    async def increment(self, key: str, amount: int = 1) -> Optional[int]:
+        """Increment counter, keeping its expiry"""
+        deadline, value = self._store.get(key, (float("inf"), b"0"))
+        count = orjson.loads(value) + amount
+        self._store[key] = (deadline, orjson.dumps(count))
+        return count
+    
+    async def increment_with_expire(self, key: str, seconds: int) -> Optional[int]:
+        """Increment counter, starting its expiry window on the first increment"""
+        if key not in self._store:
+            self._put(key, 0, seconds)
+        return await self.increment(key)
+    
+    async def set_with_expire(self, key: str, value: Any, seconds: int) -> bool:
+        """Set key with expiration time"""
+        return await self.set(key, value, seconds)
+    
+    async def acquire_lock(self, key: str, seconds: int) -> bool:
+        """Take a short-lived lock; True if this caller now holds it"""
+        if key in self._store:
+            return False
+        self._put(key, 1, seconds)
+        return True
+    
+    async def eval_rate_script(self, key: str, calls: int, window: int) -> Tuple[bool, int]:
+        """Take one token from a bucket allowing `calls` per `window` seconds; returns (allowed, retry_after_ms)"""
+        now = time.monotonic()
+        rate = calls / window
+        entry = self._store.get(key)
+        tokens, ts = orjson.loads(entry[1]) if entry else (calls, now)
+        tokens = min(calls, tokens + (now - ts) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        # An idle bucket refills within one window, so it can expire like the Redis one
+        self._put(key, [tokens, now], window)
+        return (True, 0) if allowed else (False, int((1 - tokens) / rate * 1000) + 1)
+    
+    async def health_check(self) -> bool:
+        """In-process cache is always available"""
+        return True
+    
+    async def close(self):
+        """Drop all cached entries"""
+        self._store.clear()
+
+
 class SessionManager:
     """Manage user sessions, particularly for WhatsApp 24-hour window"""
     
@@ -266,18 +489,13 @@ class RateLimitCache:
         """Increment rate limit counter"""
         key = f"rate_limit:{identifier}"
         
-        # Use Redis pipeline for atomic operations
-        async with self.cache.redis.pipeline() as pipe:
-            await pipe.incr(key)
-            await pipe.expire(key, window)
-            results = await pipe.execute()
-            return results[0]
+        return await self.cache.increment_with_expire(key, window) or 0
     
     async def get_rate_limit_info(self, identifier: str) -> Dict:
         """Get current rate limit status"""
         key = f"rate_limit:{identifier}"
         count = await self.cache.get(key) or 0
-        ttl = await self.cache.redis.ttl(key)
+        ttl = await self.cache.ttl(key)
         
         return {
             "current_count": count,
@@ -287,7 +505,7 @@ class RateLimitCache:
 
 
 # Global cache instances
-cache_service = CacheService()
+cache_service = MemoryCacheService() if settings.cache_backend == "memory" else CacheService()
 session_manager = SessionManager(cache_service)
 conversation_cache = ConversationCache(cache_service)
 rate_limit_cache = RateLimitCache(cache_service)
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Optional, List
 import os
 
 
@@ -14,6 +14,7 @@ class Settings(BaseSettings):
     api_v1_prefix: str = "/api/v1"
     port: int = 8000
     host: str = "0.0.0.0"
+    web_concurrency: int = 4  # processes calling store APIs (gunicorn -w, plus queue workers)
     
     # Security
     secret_key: str
@@ -23,13 +24,15 @@ class Settings(BaseSettings):
     # Database
     database_url: str
     database_pool_size: int = 20
-    database_max_overflow: int = 30
-    database_pool_timeout: int = 30
-    database_pool_recycle: int = 3600
+    database_max_overflow: int = 40
+    database_pool_timeout: int = 5
+    database_pool_recycle: int = 1800
+    database_echo: bool = False
     
     # Redis
     redis_url: str = "redis://localhost:6379/0"
     redis_queue_url: str = "redis://localhost:6379/1"
+    cache_backend: str = "redis"  # "memory" runs the cache in-process, without Redis
     
     # External APIs
     openai_api_key: str
@@ -46,6 +49,8 @@ class Settings(BaseSettings):
     # WooCommerce
     woocommerce_consumer_key: Optional[str] = None
     woocommerce_consumer_secret: Optional[str] = None
+    woocommerce_http2: bool = True
+    woocommerce_http1_stores: List[str] = []  # store URLs behind proxies that only speak HTTP/1.1
     
     # WhatsApp
     whatsapp_access_token: Optional[str] = None
@@ -56,6 +61,7 @@ class Settings(BaseSettings):
     # Rate Limiting
     rate_limit_calls: int = 100
     rate_limit_period: int = 60
+    webhook_rate_limit_calls: int = 600
     
     # Logging
     log_level: str = "INFO"
@@ -3,9 +3,15 @@ from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 from sqlalchemy import MetaData, DateTime, func
 from datetime import datetime
 from typing import AsyncGenerator
+import orjson
 from .config import settings
 
 
+def _json_serializer(value) -> str:
+    """Serialize JSON columns with orjson (the driver expects text)"""
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
 class Base(DeclarativeBase):
     metadata = MetaData(
         naming_convention={
@@ -35,7 +41,9 @@ engine = create_async_engine(
     pool_timeout=settings.database_pool_timeout,
     pool_recycle=settings.database_pool_recycle,
     pool_pre_ping=True,
-    echo=settings.debug
+    echo=settings.database_echo,
+    json_serializer=_json_serializer,
+    json_deserializer=orjson.loads
 )
 
 AsyncSessionLocal = async_sessionmaker(
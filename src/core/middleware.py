@@ -1,12 +1,21 @@
-import redis
+import asyncio
 import uuid
 import time
 from fastapi import Request, status
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
 from loguru import logger
-from typing import Callable
+from typing import Callable, Dict, Optional, Tuple
 from .config import settings
+from .cache import cache_service
+
+
+def _get_header(scope: dict, name: bytes) -> Optional[str]:
+    """Return the first value of a (lowercase) header straight from the ASGI scope"""
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
 
 
 class CorrelationIDMiddleware(BaseHTTPMiddleware):
@@ -53,49 +62,42 @@ class RequestLoggingMiddleware(BaseHTTPMiddleware):
 
 
 class RateLimitMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, calls: int = None, period: int = None):
+    def __init__(self, app, calls: int = None, period: int = None, webhook_calls: int = None):
         super().__init__(app)
         self.calls = calls or settings.rate_limit_calls
         self.period = period or settings.rate_limit_period
-        try:
-            self.redis = redis.from_url(settings.redis_url, decode_responses=True)
-        except Exception as e:
-            logger.error(f"Redis connection failed for rate limiting: {e}")
-            self.redis = None
+        # Webhooks get their own budget so bursts are shed before any DB work
+        self.webhook_calls = webhook_calls or settings.webhook_rate_limit_calls
     
     async def dispatch(self, request: Request, call_next: Callable):
-        if not self.redis:
-            return await call_next(request)
-        
         # Skip rate limiting for health checks
         if request.url.path in ["/health", "/", "/docs", "/redoc"]:
             return await call_next(request)
         
         client_ip = self._get_client_ip(request)
-        key = f"rate_limit:{client_ip}"
+        if "/webhooks/" in request.url.path:
+            key = f"rate_limit:webhook:{client_ip}"
+            limit = self.webhook_calls
+        else:
+            key = f"rate_limit:{client_ip}"
+            limit = self.calls
         
-        try:
-            current_calls = self.redis.get(key)
-            if current_calls is None:
-                self.redis.setex(key, self.period, 1)
-            else:
-                current_calls = int(current_calls)
-                if current_calls >= self.calls:
-                    logger.warning(
-                        f"Rate limit exceeded for {client_ip}",
-                        extra={"client_ip": client_ip, "calls": current_calls}
-                    )
-                    return JSONResponse(
-                        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                        content={
-                            "detail": "Rate limit exceeded",
-                            "error_code": "RATE_LIMIT_EXCEEDED"
-                        },
-                        headers={"Retry-After": str(self.period)}
-                    )
-                self.redis.incr(key)
-        except redis.RedisError as e:
-            logger.error(f"Redis error in rate limiting: {e}")
+        # Goes through the cache service, so CACHE_BACKEND=memory works without Redis;
+        # on cache errors the count is None and the request is let through
+        current_calls = await cache_service.increment_with_expire(key, self.period)
+        if current_calls is not None and current_calls > limit:
+            logger.warning(
+                f"Rate limit exceeded for {client_ip}",
+                extra={"client_ip": client_ip, "calls": current_calls}
+            )
+            return JSONResponse(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                content={
+                    "detail": "Rate limit exceeded",
+                    "error_code": "RATE_LIMIT_EXCEEDED"
+                },
+                headers={"Retry-After": str(self.period)}
+            )
         
         return await call_next(request)
     
@@ -124,4 +126,76 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
         response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
         response.headers["Content-Security-Policy"] = "default-src 'self'"
         
-        return response
\ No newline at end of file
+        return response
+
+
+class RequestCoalesceMiddleware(BaseHTTPMiddleware):
+    """Share one in-flight response between identical concurrent requests.
+    
+    Shopify webhook retries are keyed on (shop domain, webhook id, HMAC, path); merchant
+    management GETs on (path, query, credentials). Anything else passes through.
+    """
+    
+    def __init__(self, app, exclude_paths: Tuple[str, ...] = ("/auth/callback",)):
+        super().__init__(app)
+        self.exclude_paths = exclude_paths
+        self._in_flight: Dict[tuple, asyncio.Future] = {}
+    
+    def _coalesce_key(self, request: Request) -> Optional[tuple]:
+        path = request.url.path
+        if path.endswith(self.exclude_paths):
+            return None
+        
+        # Read raw ASGI headers so rejected/spam traffic never builds a Headers object
+        scope = request.scope
+        if request.method == "POST" and "/webhooks/" in path:
+            webhook_id = _get_header(scope, b"x-shopify-webhook-id")
+            if webhook_id:
+                # The signature is part of the key, so a forged request reusing a real webhook id
+                # is never coalesced with (and can't hand its 401 to) the genuine delivery
+                return (
+                    "webhook", _get_header(scope, b"x-shopify-shop-domain") or "", webhook_id,
+                    _get_header(scope, b"x-shopify-hmac-sha256") or "", path
+                )
+        
+        elif request.method == "GET" and "/merchants/" in path:
+            return ("get", path, request.url.query, _get_header(scope, b"authorization") or "")
+        
+        return None
+    
+    async def dispatch(self, request: Request, call_next: Callable):
+        key = self._coalesce_key(request)
+        if key is None:
+            return await call_next(request)
+        
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            logger.debug("Coalesced duplicate request: {} {}", request.method, request.url.path)
+            status_code, raw_headers, body = await asyncio.shield(in_flight)
+            return self._replay(status_code, raw_headers, body)
+        
+        future = asyncio.get_running_loop().create_future()
+        # Mark exceptions as retrieved even when no duplicate ends up waiting on them
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._in_flight[key] = future
+        try:
+            response = await call_next(request)
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            shared = (response.status_code, list(response.raw_headers), body)
+            future.set_result(shared)
+            return self._replay(*shared)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            # A cancelled leader (client disconnect, timeout) must not leave duplicates waiting forever
+            if not future.done():
+                future.set_exception(RuntimeError("Coalesced request was cancelled"))
+            del self._in_flight[key]
+    
+    @staticmethod
+    def _replay(status_code: int, raw_headers: list, body: bytes) -> Response:
+        """Rebuild a buffered response, keeping repeated headers such as set-cookie"""
+        response = Response(content=body, status_code=status_code)
+        response.raw_headers = list(raw_headers)
+        return response
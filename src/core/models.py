@@ -1,6 +1,6 @@
 from sqlalchemy import (
     String, Text, Integer, BigInteger, Boolean, DateTime, 
-    ForeignKey, Index, CheckConstraint, JSON
+    ForeignKey, Index, CheckConstraint, UniqueConstraint, JSON
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.dialects.postgresql import UUID
@@ -52,6 +52,12 @@ class Merchant(Base):
     __table_args__ = (
         Index("ix_merchants_platform_domain", "platform_type", "platform_domain"),
         Index("ix_merchants_active", "is_active", "created_at"),
+        Index(
+            "ix_merchants_shopify_active", "shopify_shop_domain",
+            postgresql_where="platform_type = 'shopify' AND is_active = true",
+            postgresql_include=["shopify_webhook_secret"]
+        ),
+        UniqueConstraint("shopify_shop_domain", "platform_type", name="uq_merchants_shopify_shop_domain"),
         CheckConstraint("platform_type IN ('shopify', 'woocommerce')", name="ck_merchants_platform_type"),
     )
 
@@ -91,6 +97,7 @@ class Customer(Base):
         Index("ix_customers_whatsapp", "whatsapp_id"),
         Index("ix_customers_phone", "phone_number"),
         Index("ix_customers_email", "email"),
+        UniqueConstraint("merchant_id", "email", name="uq_customers_merchant_email"),
     )
 
 
@@ -210,7 +217,7 @@ class Order(Base):
     customer: Mapped[Optional["Customer"]] = relationship("Customer")
     
     __table_args__ = (
-        Index("ix_orders_merchant_external", "merchant_id", "external_order_id"),
+        UniqueConstraint("merchant_id", "external_order_id", name="uq_orders_merchant_external"),
         Index("ix_orders_number", "order_number"),
         Index("ix_orders_customer_email", "customer_email"),
         Index("ix_orders_status", "status", "created_at"),
@@ -269,7 +276,7 @@ class AuditLog(Base):
     
     # Change details
     changes: Mapped[Optional[dict]] = mapped_column(JSON)
-    metadata: Mapped[Optional[dict]] = mapped_column(JSON)
+    event_metadata: Mapped[Optional[dict]] = mapped_column("metadata", JSON)  # "metadata" is reserved on declarative models
     
     # GDPR compliance
     legal_basis: Mapped[Optional[str]] = mapped_column(String(100))
@@ -1,6 +1,7 @@
 import asyncio
-import json
-from typing import Dict, Any, Optional, Callable
+import msgpack
+from collections import deque
+from typing import Dict, Any, Optional, Callable, List, Set, Tuple
 from datetime import datetime, timedelta
 from enum import Enum
 import redis.asyncio as redis
@@ -10,6 +11,16 @@ from dataclasses import dataclass
 from .config import settings
 
 
+def _dumps(data: Dict[str, Any]) -> bytes:
+    """Serialize a task for Redis; deterministic so SREM matches the SADD'ed member"""
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def _loads(data: bytes) -> Dict[str, Any]:
+    """Deserialize a task read back from Redis"""
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
 class QueuePriority(Enum):
     LOW = "low"
     NORMAL = "normal"
@@ -50,7 +61,7 @@ class AsyncQueue:
     
     def __init__(self, redis_url: str = None):
         self.redis_url = redis_url or settings.redis_queue_url
-        self.redis = redis.from_url(self.redis_url, decode_responses=True)
+        self.redis = redis.from_url(self.redis_url)
         self.task_processors: Dict[str, Callable] = {}
         self.running = False
         
@@ -92,13 +103,13 @@ class AsyncQueue:
                 # Schedule task for later processing
                 scheduled_key = f"{self.SCHEDULED_PREFIX}:{task.queue_name}"
                 score = task.scheduled_at.timestamp()
-                await self.redis.zadd(scheduled_key, {json.dumps(task_data): score})
+                await self.redis.zadd(scheduled_key, {_dumps(task_data): score})
             else:
                 # Add to immediate processing queue
                 queue_key = f"{self.QUEUE_PREFIX}:{task.queue_name}:{task.priority.value}"
-                await self.redis.lpush(queue_key, json.dumps(task_data))
+                await self.redis.lpush(queue_key, _dumps(task_data))
             
-            logger.info(f"Enqueued task {task.id} to {task.queue_name} with priority {task.priority.value}")
+            logger.info("Enqueued task {} to {} with priority {}", task.id, task.queue_name, task.priority.value)
             return True
             
         except Exception as e:
@@ -111,21 +122,21 @@ class AsyncQueue:
             # Check scheduled tasks first
             await self._process_scheduled_tasks(queue_name)
             
-            # Try to get task from priority queues (highest to lowest)
-            for priority in [QueuePriority.CRITICAL, QueuePriority.HIGH, QueuePriority.NORMAL, QueuePriority.LOW]:
-                queue_key = f"{self.QUEUE_PREFIX}:{queue_name}:{priority.value}"
+            # One blocking pop across the priority queues; Redis serves the keys highest first
+            queue_keys = [
+                f"{self.QUEUE_PREFIX}:{queue_name}:{priority.value}"
+                for priority in [QueuePriority.CRITICAL, QueuePriority.HIGH, QueuePriority.NORMAL, QueuePriority.LOW]
+            ]
+            result = await self.redis.brpop(queue_keys, timeout=timeout)
+            if result:
+                _, task_data = result
+                task_dict = _loads(task_data)
                 
-                # Use blocking pop with timeout
-                result = await self.redis.brpop(queue_key, timeout=timeout)
-                if result:
-                    _, task_data = result
-                    task_dict = json.loads(task_data)
-                    
-                    # Move to processing set
-                    processing_key = f"{self.PROCESSING_PREFIX}:{queue_name}"
-                    await self.redis.sadd(processing_key, task_data)
-                    
-                    return self._dict_to_task(task_dict)
+                # Move to processing set
+                processing_key = f"{self.PROCESSING_PREFIX}:{queue_name}"
+                await self.redis.sadd(processing_key, task_data)
+                
+                return self._dict_to_task(task_dict)
             
             return None
             
@@ -146,7 +157,7 @@ class AsyncQueue:
                 # Remove from scheduled and add to immediate queue
                 await self.redis.zrem(scheduled_key, task_data)
                 
-                task_dict = json.loads(task_data)
+                task_dict = _loads(task_data)
                 priority = QueuePriority(task_dict["priority"])
                 queue_key = f"{self.QUEUE_PREFIX}:{queue_name}:{priority.value}"
                 
@@ -158,13 +169,10 @@ class AsyncQueue:
     async def complete_task(self, task: QueueTask) -> bool:
         """Mark task as completed"""
         try:
-            processing_key = f"{self.PROCESSING_PREFIX}:{task.queue_name}"
-            task_data = json.dumps(self._task_to_dict(task))
-            
             # Remove from processing set
-            await self.redis.srem(processing_key, task_data)
+            await self._remove_processing(task)
             
-            logger.info(f"Completed task {task.id}")
+            logger.info("Completed task {}", task.id)
             return True
             
         except Exception as e:
@@ -174,11 +182,8 @@ class AsyncQueue:
     async def fail_task(self, task: QueueTask, error_message: str = None) -> bool:
         """Handle task failure with retry logic"""
         try:
-            processing_key = f"{self.PROCESSING_PREFIX}:{task.queue_name}"
-            task_data = json.dumps(self._task_to_dict(task))
-            
             # Remove from processing
-            await self.redis.srem(processing_key, task_data)
+            await self._remove_processing(task)
             
             if task.retry_count < task.max_retries:
                 # Retry with exponential backoff
@@ -190,12 +195,11 @@ class AsyncQueue:
                 return await self.enqueue(task)
             else:
                 # Max retries reached, move to failed queue
-                failed_key = f"{self.FAILED_PREFIX}:{task.queue_name}"
                 failed_data = self._task_to_dict(task)
                 failed_data["error_message"] = error_message
                 failed_data["failed_at"] = datetime.utcnow().isoformat()
                 
-                await self.redis.lpush(failed_key, json.dumps(failed_data))
+                await self._push_failed(task.queue_name, failed_data)
                 
                 logger.error(f"Task {task.id} failed permanently after {task.max_retries} retries")
                 return False
@@ -204,6 +208,16 @@ class AsyncQueue:
             logger.error(f"Failed to handle task failure for {task.id}: {e}")
             return False
     
+    async def _remove_processing(self, task: QueueTask):
+        """Drop a task from its queue's processing set"""
+        processing_key = f"{self.PROCESSING_PREFIX}:{task.queue_name}"
+        await self.redis.srem(processing_key, _dumps(self._task_to_dict(task)))
+    
+    async def _push_failed(self, queue_name: str, failed_data: Dict):
+        """Record a permanently failed task"""
+        failed_key = f"{self.FAILED_PREFIX}:{queue_name}"
+        await self.redis.lpush(failed_key, _dumps(failed_data))
+    
     async def start_worker(self, queue_name: str):
         """Start processing tasks from queue"""
         self.running = True
@@ -233,7 +247,7 @@ class AsyncQueue:
                 await self.fail_task(task, f"No processor for task type: {task.task_type}")
                 return
             
-            logger.info(f"Processing task {task.id} of type {task.task_type}")
+            logger.info("Processing task {} of type {}", task.id, task.task_type)
             
             # Execute task processor
             result = await processor(task.payload)
@@ -241,7 +255,7 @@ class AsyncQueue:
             # Mark as completed
             await self.complete_task(task)
             
-            logger.info(f"Successfully processed task {task.id}")
+            logger.info("Successfully processed task {}", task.id)
             
         except Exception as e:
             logger.error(f"Task processing failed for {task.id}: {e}")
@@ -319,8 +333,94 @@ class AsyncQueue:
             logger.error(f"Error closing queue Redis connection: {e}")
 
 
+class MemoryQueue(AsyncQueue):
+    """In-process queue with the AsyncQueue surface, for running without Redis (CACHE_BACKEND=memory)"""
+    
+    def __init__(self):
+        self.redis = None
+        self.task_processors: Dict[str, Callable] = {}
+        self.running = False
+        self._pending: Dict[Tuple[str, QueuePriority], deque] = {}
+        self._scheduled: Dict[str, List[QueueTask]] = {}
+        self._processing: Dict[str, Set[str]] = {}
+        self._failed: Dict[str, List[Dict]] = {}
+        self._ready: Dict[str, asyncio.Event] = {}
+    
+    def _event(self, queue_name: str) -> asyncio.Event:
+        return self._ready.setdefault(queue_name, asyncio.Event())
+    
+    def _push(self, task: QueueTask):
+        self._pending.setdefault((task.queue_name, task.priority), deque()).append(task)
+        self._event(task.queue_name).set()
+    
+    async def enqueue(self, task: QueueTask) -> bool:
+        """Add task to queue"""
+        if task.delay_seconds > 0:
+            self._scheduled.setdefault(task.queue_name, []).append(task)
+        else:
+            self._push(task)
+        logger.info("Enqueued task {} to {} with priority {}", task.id, task.queue_name, task.priority.value)
+        return True
+    
+    async def dequeue(self, queue_name: str, timeout: int = 10) -> Optional[QueueTask]:
+        """Get next task from queue (priority-based)"""
+        await self._process_scheduled_tasks(queue_name)
+        for priority in [QueuePriority.CRITICAL, QueuePriority.HIGH, QueuePriority.NORMAL, QueuePriority.LOW]:
+            pending = self._pending.get((queue_name, priority))
+            if pending:
+                task = pending.popleft()
+                self._processing.setdefault(queue_name, set()).add(task.id)
+                return task
+        
+        # Nothing ready: wait for the next enqueue, then let the caller poll again
+        event = self._event(queue_name)
+        event.clear()
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return None
+    
+    async def _process_scheduled_tasks(self, queue_name: str):
+        """Move scheduled tasks to immediate queue when ready"""
+        scheduled = self._scheduled.get(queue_name)
+        if not scheduled:
+            return
+        now = datetime.utcnow()
+        self._scheduled[queue_name] = [task for task in scheduled if task.scheduled_at > now]
+        for task in scheduled:
+            if task.scheduled_at <= now:
+                self._push(task)
+    
+    async def _remove_processing(self, task: QueueTask):
+        """Drop a task from its queue's processing set"""
+        self._processing.get(task.queue_name, set()).discard(task.id)
+    
+    async def _push_failed(self, queue_name: str, failed_data: Dict):
+        """Record a permanently failed task"""
+        self._failed.setdefault(queue_name, []).append(failed_data)
+    
+    async def get_queue_stats(self, queue_name: str) -> Dict:
+        """Get queue statistics"""
+        stats = {"queue_name": queue_name}
+        for priority in QueuePriority:
+            stats[f"{priority.value}_count"] = len(self._pending.get((queue_name, priority), ()))
+        stats["scheduled_count"] = len(self._scheduled.get(queue_name, ()))
+        stats["processing_count"] = len(self._processing.get(queue_name, ()))
+        stats["failed_count"] = len(self._failed.get(queue_name, ()))
+        return stats
+    
+    async def health_check(self) -> bool:
+        """In-process queue is always available"""
+        return True
+    
+    async def close(self):
+        """Nothing to release in-process"""
+        self.running = False
+
+
 # Global queue instance
-async_queue = AsyncQueue()
+async_queue = MemoryQueue() if settings.cache_backend == "memory" else AsyncQueue()
 
 
 # Task processors
@@ -331,18 +431,20 @@ async def process_webhook_task(payload: Dict[str, Any]) -> Dict:
         merchant_id = payload.get("merchant_id")
         data = payload.get("data")
         
-        logger.info(f"Processing webhook: {webhook_type} for merchant {merchant_id}")
+        logger.info("Processing webhook: {} for merchant {}", webhook_type, merchant_id)
         
         # Route to appropriate handler based on webhook type
-        if webhook_type == "shopify.order.created":
-            from ..integrations.shopify.webhooks import handle_order_created
-            return await handle_order_created(data, merchant_id)
+        if webhook_type.startswith("shopify."):
+            from ..integrations.shopify.webhooks import WEBHOOK_TOPIC_HANDLERS
+            handler = WEBHOOK_TOPIC_HANDLERS.get(webhook_type[len("shopify."):])
+            if handler:
+                return await handler(data, merchant_id)
         elif webhook_type == "whatsapp.message.received":
             from ..integrations.whatsapp.handlers import handle_incoming_message
             return await handle_incoming_message(data, merchant_id)
-        else:
-            logger.warning(f"Unknown webhook type: {webhook_type}")
-            return {"status": "ignored", "reason": "unknown_webhook_type"}
+        
+        logger.warning(f"Unknown webhook type: {webhook_type}")
+        return {"status": "ignored", "reason": "unknown_webhook_type"}
             
     except Exception as e:
         logger.error(f"Webhook processing failed: {e}")
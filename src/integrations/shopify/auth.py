@@ -1,13 +1,15 @@
+import asyncio
 import hmac
 import hashlib
 import secrets
-from urllib.parse import urlencode, parse_qs
-from typing import Dict, Optional, Tuple
+from urllib.parse import urlencode, parse_qsl, quote_plus
+from typing import Dict, Optional, Tuple, Union
 import httpx
 from loguru import logger
 
 from ...core.config import settings
 from ...core.exceptions import ShopifyAPIException
+from .client import _normalize_shop, SHOPIFY_TIMEOUT
 
 
 class ShopifyOAuth:
@@ -19,6 +21,8 @@ class ShopifyOAuth:
         if not all([self.client_id, self.client_secret]):
             raise ValueError("Shopify client ID and secret must be provided")
         
+        self._client_secret_bytes = self.client_secret.encode('utf-8')
+        
         # Default scopes for e-commerce support bot
         self.default_scopes = [
             "read_orders",
@@ -30,33 +34,53 @@ class ShopifyOAuth:
             "write_orders",  # For order updates
             "write_customers"  # For customer communication tracking
         ]
+        
+        # Authorization URL with the static, pre-escaped query params baked in
+        static_params = urlencode({
+            'client_id': self.client_id,
+            'scope': ','.join(self.default_scopes),
+            'redirect_uri': self.redirect_uri
+        }).replace('{', '{{').replace('}', '}}')
+        self._auth_url_template = (
+            f"https://{{shop}}/admin/oauth/authorize?{static_params}"
+            "&state={state}&grant_options%5B%5D=per-user"
+        )
     
-    def verify_installation_request(self, query_string: str) -> bool:
+    def verify_installation_request(self, query_string: Union[str, bytes]) -> bool:
         """Verify Shopify installation request HMAC signature"""
         try:
-            params = parse_qs(query_string)
-            hmac_param = params.pop('hmac', [None])[0]
+            if isinstance(query_string, str):
+                query_string = query_string.encode('utf-8')
+            
+            # Single pass over the raw query: split out the hmac segment
+            hmac_param = None
+            segments = []
+            for segment in query_string.split(b'&'):
+                if segment.startswith(b'hmac='):
+                    hmac_param = segment[5:]
+                elif segment:
+                    segments.append(segment)
             
             if not hmac_param:
                 logger.warning("Missing HMAC parameter in Shopify installation request")
                 return False
             
-            # Reconstruct query string without HMAC
-            sorted_params = sorted(params.items())
-            query_string_without_hmac = '&'.join([f'{k}={v[0]}' for k, v in sorted_params])
+            if b'%' in query_string or b'+' in query_string:
+                # Encoded values are signed in their decoded form
+                params = sorted(parse_qsl(query_string.decode('utf-8')))
+                message = '&'.join(f'{k}={v}' for k, v in params if k != 'hmac').encode('utf-8')
+            else:
+                segments.sort(key=lambda segment: segment.partition(b'=')[0])
+                message = b'&'.join(segments)
             
             # Calculate expected HMAC
-            expected_digest = hmac.new(
-                self.client_secret.encode('utf-8'),
-                query_string_without_hmac.encode('utf-8'),
-                hashlib.sha256
-            ).hexdigest()
+            expected_digest = hmac.new(self._client_secret_bytes, message, hashlib.sha256).hexdigest().encode()
             
             # Compare with provided HMAC
             is_valid = hmac.compare_digest(expected_digest, hmac_param)
             
             if not is_valid:
-                logger.warning(f"Invalid HMAC in Shopify installation request: expected {expected_digest}, got {hmac_param}")
+                logger.warning(f"Invalid HMAC in Shopify installation request: got {hmac_param.decode(errors='replace')}")
             
             return is_valid
             
@@ -67,26 +91,24 @@ class ShopifyOAuth:
     def generate_auth_url(self, shop_domain: str, scopes: list = None, state: str = None) -> Tuple[str, str]:
         """Generate OAuth authorization URL with CSRF protection"""
         try:
-            # Normalize shop domain
-            if not shop_domain.endswith('.myshopify.com'):
-                shop_domain = f"{shop_domain}.myshopify.com"
+            shop_domain = _normalize_shop(shop_domain)
             
             # Generate CSRF state token if not provided
             if not state:
-                state = secrets.token_hex(16)
-            
-            # Use provided scopes or defaults
-            scopes_list = scopes or self.default_scopes
+                state = secrets.token_urlsafe(16)
             
-            params = {
-                'client_id': self.client_id,
-                'scope': ','.join(scopes_list),
-                'redirect_uri': self.redirect_uri,
-                'state': state,
-                'grant_options[]': 'per-user'  # Request online access token
-            }
-            
-            auth_url = f"https://{shop_domain}/admin/oauth/authorize?{urlencode(params)}"
+            if scopes:
+                params = {
+                    'client_id': self.client_id,
+                    'scope': ','.join(scopes),
+                    'redirect_uri': self.redirect_uri,
+                    'state': state,
+                    'grant_options[]': 'per-user'  # Request online access token
+                }
+                auth_url = f"https://{shop_domain}/admin/oauth/authorize?{urlencode(params)}"
+            else:
+                # Default scopes: only the shop and state vary per install
+                auth_url = self._auth_url_template.format(shop=shop_domain, state=quote_plus(state))
             
             logger.info(f"Generated Shopify auth URL for shop: {shop_domain}")
             return auth_url, state
@@ -98,9 +120,7 @@ class ShopifyOAuth:
     async def exchange_code_for_token(self, shop_domain: str, code: str, state: str = None) -> Dict:
         """Exchange authorization code for access token"""
         try:
-            # Normalize shop domain
-            if not shop_domain.endswith('.myshopify.com'):
-                shop_domain = f"{shop_domain}.myshopify.com"
+            shop_domain = _normalize_shop(shop_domain)
             
             token_url = f"https://{shop_domain}/admin/oauth/access_token"
             
@@ -110,7 +130,7 @@ class ShopifyOAuth:
                 'code': code
             }
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
+            async with httpx.AsyncClient(timeout=SHOPIFY_TIMEOUT) as client:
                 response = await client.post(token_url, json=payload)
                 
                 if response.status_code != 200:
@@ -144,8 +164,7 @@ class ShopifyOAuth:
     async def verify_token(self, shop_domain: str, access_token: str) -> bool:
         """Verify access token is valid by making a test API call"""
         try:
-            if not shop_domain.endswith('.myshopify.com'):
-                shop_domain = f"{shop_domain}.myshopify.com"
+            shop_domain = _normalize_shop(shop_domain)
             
             test_url = f"https://{shop_domain}/admin/api/{settings.shopify_api_version}/shop.json"
             
@@ -154,7 +173,7 @@ class ShopifyOAuth:
                 'Content-Type': 'application/json'
             }
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
+            async with httpx.AsyncClient(timeout=SHOPIFY_TIMEOUT) as client:
                 response = await client.get(test_url, headers=headers)
                 
                 if response.status_code == 200:
@@ -174,8 +193,7 @@ class ShopifyOAuth:
     async def get_shop_info(self, shop_domain: str, access_token: str) -> Optional[Dict]:
         """Get shop information using access token"""
         try:
-            if not shop_domain.endswith('.myshopify.com'):
-                shop_domain = f"{shop_domain}.myshopify.com"
+            shop_domain = _normalize_shop(shop_domain)
             
             shop_url = f"https://{shop_domain}/admin/api/{settings.shopify_api_version}/shop.json"
             
@@ -184,7 +202,7 @@ class ShopifyOAuth:
                 'Content-Type': 'application/json'
             }
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
+            async with httpx.AsyncClient(timeout=SHOPIFY_TIMEOUT) as client:
                 response = await client.get(shop_url, headers=headers)
                 
                 if response.status_code == 200:
@@ -200,13 +218,12 @@ class ShopifyOAuth:
     
     def generate_webhook_verification_token(self) -> str:
         """Generate a secure webhook verification token"""
-        return secrets.token_hex(32)
+        return secrets.token_urlsafe(32)
     
     async def create_webhook(self, shop_domain: str, access_token: str, topic: str, address: str, verification_token: str = None) -> Optional[Dict]:
         """Create a webhook in Shopify"""
         try:
-            if not shop_domain.endswith('.myshopify.com'):
-                shop_domain = f"{shop_domain}.myshopify.com"
+            shop_domain = _normalize_shop(shop_domain)
             
             webhook_url = f"https://{shop_domain}/admin/api/{settings.shopify_api_version}/webhooks.json"
             
@@ -226,7 +243,7 @@ class ShopifyOAuth:
             if verification_token:
                 webhook_data['webhook']['api_client_id'] = verification_token
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
+            async with httpx.AsyncClient(timeout=SHOPIFY_TIMEOUT) as client:
                 response = await client.post(webhook_url, headers=headers, json=webhook_data)
                 
                 if response.status_code == 201:
@@ -254,17 +271,19 @@ class ShopifyOAuth:
             'app/uninstalled'
         ]
         
-        results = {}
         verification_token = self.generate_webhook_verification_token()
         
-        for topic in required_webhooks:
-            webhook_url = f"{webhook_base_url}/shopify/webhooks/{topic.replace('/', '_')}"
-            webhook_info = await self.create_webhook(
-                shop_domain, access_token, topic, webhook_url, verification_token
+        # Topics are independent, so register them concurrently
+        webhook_infos = await asyncio.gather(*(
+            self.create_webhook(
+                shop_domain, access_token, topic,
+                f"{webhook_base_url}/shopify/webhooks/{topic.replace('/', '_')}",
+                verification_token
             )
-            results[topic] = webhook_info is not None
+            for topic in required_webhooks
+        ))
         
-        return results
+        return {topic: info is not None for topic, info in zip(required_webhooks, webhook_infos)}
 
 
 # Global Shopify OAuth instance
@@ -1,6 +1,9 @@
 import asyncio
 import httpx
-from typing import Dict, Any, Optional, List
+import orjson
+from functools import lru_cache
+from typing import Dict, Any, Optional, List, Tuple, AsyncIterator
+from urllib.parse import urlparse, parse_qs
 from datetime import datetime, timedelta
 from loguru import logger
 
@@ -9,15 +12,63 @@ from ...core.exceptions import ShopifyAPIException
 from ...core.cache import cache_service
 
 
+@lru_cache(maxsize=1024)
+def _normalize_shop(shop_domain: str) -> str:
+    """Normalize a shop name to its full .myshopify.com domain"""
+    return shop_domain if shop_domain.endswith('.myshopify.com') else shop_domain + '.myshopify.com'
+
+
+@lru_cache(maxsize=256)
+def _isoformat(value: datetime) -> str:
+    """ISO-format a datetime, memoized for filter windows reused across calls"""
+    return value.isoformat()
+
+
+# Fail fast on slow peers so connections return to the bounded pool quickly
+SHOPIFY_TIMEOUT = httpx.Timeout(connect=3.0, read=10.0, write=10.0, pool=5.0)
+
+# Shared HTTP/2 client: concurrent Shopify calls multiplex over one TCP+TLS connection per shop
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get the process-wide HTTP client used for Shopify API calls"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=SHOPIFY_TIMEOUT,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+        )
+    return _http_client
+
+
+async def close_http_client():
+    """Close the shared Shopify HTTP client"""
+    global _http_client
+    _api_clients.clear()
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
 class ShopifyAPIClient:
     """Shopify API client with rate limiting and retry logic"""
     
     def __init__(self, shop_domain: str, access_token: str):
-        self.shop_domain = shop_domain.replace('.myshopify.com', '') + '.myshopify.com'
+        self.shop_domain = _normalize_shop(shop_domain)
         self.access_token = access_token
         self.api_version = settings.shopify_api_version
         self.base_url = f"https://{self.shop_domain}/admin/api/{self.api_version}"
         
+        # Static request headers and resolved endpoint URLs, built once per client
+        self._headers = {
+            'X-Shopify-Access-Token': access_token,
+            'Content-Type': 'application/json',
+            'User-Agent': f'ECommerce-Bot/{settings.version}'
+        }
+        self._endpoint_cache: Dict[str, str] = {}
+        
         # Rate limiting settings (Shopify allows 40 requests per second)
         self.rate_limit_calls = 35  # Conservative limit
         self.rate_limit_window = 1  # 1 second
@@ -32,67 +83,70 @@ class ShopifyAPIClient:
         endpoint: str,
         params: Dict = None,
         data: Dict = None,
-        retry_count: int = 0
+        headers: Dict = None
     ) -> httpx.Response:
         """Make API request with rate limiting and retry logic"""
         
-        # Check rate limit
+        # Check rate limit once per logical request, not per retry
         await self._check_rate_limit()
         
-        url = f"{self.base_url}/{endpoint.lstrip('/')}"
-        headers = {
-            'X-Shopify-Access-Token': self.access_token,
-            'Content-Type': 'application/json',
-            'User-Agent': f'ECommerce-Bot/{settings.version}'
-        }
+        url = self._endpoint_cache.get(endpoint) or self._endpoint_cache.setdefault(
+            endpoint, f"{self.base_url}/{endpoint.lstrip('/')}"
+        )
+        request_headers = {**self._headers, **headers} if headers else self._headers
         
-        try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.request(
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await get_http_client().request(
                     method=method,
                     url=url,
-                    headers=headers,
+                    headers=request_headers,
                     params=params,
                     json=data
                 )
-                
-                # Handle rate limiting (429) and server errors (5xx)
-                if response.status_code == 429:
+                logger.debug("Shopify {} {} -> {} over {}", method, endpoint, response.status_code, response.http_version)
+            except httpx.RequestError as e:
+                if isinstance(e, httpx.PoolTimeout):
+                    logger.warning(f"Shopify connection pool saturated while calling {endpoint}")
+                if attempt < self.max_retries:
+                    wait_time = self.backoff_factor ** attempt
+                    logger.warning(f"Network error: {e}. Retrying in {wait_time} seconds...")
+                    await asyncio.sleep(wait_time)
+                    continue
+                raise ShopifyAPIException(f"Network error: {str(e)}")
+            
+            # Handle rate limiting (429) and server errors (5xx)
+            if response.status_code == 429:
+                if attempt < self.max_retries:
                     retry_after = int(response.headers.get('Retry-After', 60))
                     logger.warning(f"Rate limited by Shopify. Waiting {retry_after} seconds...")
                     await asyncio.sleep(retry_after)
-                    if retry_count < self.max_retries:
-                        return await self._make_request(method, endpoint, params, data, retry_count + 1)
-                    else:
-                        raise ShopifyAPIException("Rate limit exceeded, max retries reached")
-                
-                elif response.status_code >= 500:
-                    if retry_count < self.max_retries:
-                        wait_time = self.backoff_factor ** retry_count
-                        logger.warning(f"Server error {response.status_code}. Retrying in {wait_time} seconds...")
-                        await asyncio.sleep(wait_time)
-                        return await self._make_request(method, endpoint, params, data, retry_count + 1)
-                    else:
-                        raise ShopifyAPIException(f"Server error {response.status_code}, max retries reached")
-                
-                elif response.status_code >= 400:
-                    error_data = response.json() if response.content else {}
-                    error_message = error_data.get('errors', f'HTTP {response.status_code}')
-                    raise ShopifyAPIException(f"API error: {error_message}")
-                
-                # Update rate limit tracking
-                await self._update_rate_limit()
-                
-                return response
-                
-        except httpx.RequestError as e:
-            if retry_count < self.max_retries:
-                wait_time = self.backoff_factor ** retry_count
-                logger.warning(f"Network error: {e}. Retrying in {wait_time} seconds...")
-                await asyncio.sleep(wait_time)
-                return await self._make_request(method, endpoint, params, data, retry_count + 1)
-            else:
-                raise ShopifyAPIException(f"Network error: {str(e)}")
+                    continue
+                raise ShopifyAPIException("Rate limit exceeded, max retries reached")
+            
+            elif response.status_code >= 500:
+                if attempt < self.max_retries:
+                    wait_time = self.backoff_factor ** attempt
+                    logger.warning(f"Server error {response.status_code}. Retrying in {wait_time} seconds...")
+                    await asyncio.sleep(wait_time)
+                    continue
+                raise ShopifyAPIException(f"Server error {response.status_code}, max retries reached")
+            
+            elif response.status_code == 404:
+                # Common for order/customer lookups; no need to parse the error body
+                raise ShopifyAPIException("API error: Not Found", status_code=404)
+            
+            elif response.status_code >= 400:
+                try:
+                    error_message = orjson.loads(response.content).get('errors', f'HTTP {response.status_code}')
+                except (orjson.JSONDecodeError, AttributeError):
+                    error_message = f'HTTP {response.status_code}'
+                raise ShopifyAPIException(f"API error: {error_message}", status_code=response.status_code)
+            
+            # Update rate limit tracking
+            await self._update_rate_limit()
+            
+            return response
     
     async def _check_rate_limit(self):
         """Check if we're within rate limits"""
@@ -107,31 +161,88 @@ class ShopifyAPIClient:
     async def _update_rate_limit(self):
         """Update rate limit counter"""
         rate_key = f"shopify_rate_limit:{self.shop_domain}"
-        await cache_service.increment(rate_key)
-        # Set expiry if it's a new key
-        if not await cache_service.exists(rate_key):
-            await cache_service.set_with_expire(rate_key, 1, self.rate_limit_window)
+        await cache_service.increment_with_expire(rate_key, self.rate_limit_window)
     
     async def get(self, endpoint: str, params: Dict = None) -> Dict[str, Any]:
         """GET request"""
         response = await self._make_request('GET', endpoint, params=params)
-        return response.json()
+        return orjson.loads(response.content)
     
     async def post(self, endpoint: str, data: Dict = None) -> Dict[str, Any]:
         """POST request"""
         response = await self._make_request('POST', endpoint, data=data)
-        return response.json()
+        return orjson.loads(response.content)
     
     async def put(self, endpoint: str, data: Dict = None) -> Dict[str, Any]:
         """PUT request"""
         response = await self._make_request('PUT', endpoint, data=data)
-        return response.json()
+        return orjson.loads(response.content)
     
     async def delete(self, endpoint: str) -> bool:
         """DELETE request"""
         response = await self._make_request('DELETE', endpoint)
         return response.status_code == 200
     
+    async def _get_revalidated(self, endpoint: str, resource: str, cache_key: str, ttl: int) -> Dict[str, Any]:
+        """GET a single resource, revalidating the last known ETag with If-None-Match"""
+        etag, stale_body = await cache_service.get_with_etag(cache_key)
+        headers = {'If-None-Match': etag} if etag else None
+        
+        response = await self._make_request('GET', endpoint, headers=headers)
+        
+        if response.status_code == 304 and stale_body is not None:
+            # Unchanged upstream: reuse the stored body without transferring or parsing it
+            body = stale_body
+        else:
+            body = orjson.loads(response.content).get(resource, {})
+            new_etag = response.headers.get('ETag')
+            if new_etag:
+                await cache_service.set_with_etag(cache_key, new_etag, body)
+        
+        await cache_service.cache_with_jitter(cache_key, body, ttl)
+        return body
+    
+    async def _get_page(self, endpoint: str, resource: str, params: Dict) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """GET one page of a list endpoint and return its items with the next page_info cursor"""
+        response = await self._make_request('GET', endpoint, params=params)
+        items = orjson.loads(response.content).get(resource, [])
+        
+        next_url = response.links.get('next', {}).get('url')
+        if not next_url:
+            return items, None
+        return items, parse_qs(urlparse(next_url).query).get('page_info', [None])[0]
+    
+    async def _iter_pages(self, endpoint: str, resource: str, params: Dict) -> AsyncIterator[Dict[str, Any]]:
+        """Yield items from every page, fetching the next page while the caller consumes the current one"""
+        pages: asyncio.Queue = asyncio.Queue(maxsize=2)
+        
+        async def fetch_pages():
+            page_params = params
+            try:
+                while True:
+                    items, page_info = await self._get_page(endpoint, resource, page_params)
+                    await pages.put(items)
+                    if not page_info:
+                        break
+                    # Shopify rejects other filters alongside page_info; they are encoded in the cursor
+                    page_params = {'limit': params.get('limit', 50), 'page_info': page_info}
+                await pages.put(None)
+            except Exception as e:
+                await pages.put(e)
+        
+        fetcher = asyncio.create_task(fetch_pages())
+        try:
+            while True:
+                items = await pages.get()
+                if items is None:
+                    break
+                if isinstance(items, Exception):
+                    raise items
+                for item in items:
+                    yield item
+        finally:
+            fetcher.cancel()
+    
     # Shop methods
     async def get_shop_info(self) -> Dict[str, Any]:
         """Get shop information"""
@@ -142,13 +253,8 @@ class ShopifyAPIClient:
         if cached_info:
             return cached_info
         
-        response = await self.get('/shop.json')
-        shop_info = response.get('shop', {})
-        
         # Cache for 1 hour
-        await cache_service.cache_with_jitter(cache_key, shop_info, cache_service.TTL_SHORT * 60)
-        
-        return shop_info
+        return await self._get_revalidated('/shop.json', 'shop', cache_key, cache_service.TTL_SHORT * 60)
     
     # Order methods
     async def get_order(self, order_id: str) -> Optional[Dict[str, Any]]:
@@ -171,6 +277,29 @@ class ShopifyAPIClient:
         except ShopifyAPIException:
             return None
     
+    @staticmethod
+    def _order_params(
+        status: str = None,
+        financial_status: str = None,
+        fulfillment_status: str = None,
+        since_id: str = None,
+        created_at_min: datetime = None,
+        created_at_max: datetime = None,
+        limit: int = 50
+    ) -> Dict[str, Any]:
+        """Build the orders.json query string for the given filters"""
+        return {
+            k: v for k, v in (
+                ('status', status),
+                ('financial_status', financial_status),
+                ('fulfillment_status', fulfillment_status),
+                ('since_id', since_id),
+                ('created_at_min', _isoformat(created_at_min) if created_at_min else None),
+                ('created_at_max', _isoformat(created_at_max) if created_at_max else None),
+                ('limit', min(limit, 250))  # Max 250 per request
+            ) if v is not None
+        }
+    
     async def get_orders(
         self,
         status: str = None,
@@ -182,24 +311,46 @@ class ShopifyAPIClient:
         limit: int = 50
     ) -> List[Dict[str, Any]]:
         """Get orders with filters"""
-        params = {'limit': min(limit, 250)}  # Max 250 per request
-        
-        if status:
-            params['status'] = status
-        if financial_status:
-            params['financial_status'] = financial_status
-        if fulfillment_status:
-            params['fulfillment_status'] = fulfillment_status
-        if since_id:
-            params['since_id'] = since_id
-        if created_at_min:
-            params['created_at_min'] = created_at_min.isoformat()
-        if created_at_max:
-            params['created_at_max'] = created_at_max.isoformat()
+        params = self._order_params(
+            status, financial_status, fulfillment_status, since_id, created_at_min, created_at_max, limit
+        )
         
         response = await self.get('/orders.json', params)
         return response.get('orders', [])
     
+    async def iter_orders(self, **filters) -> AsyncIterator[Dict[str, Any]]:
+        """Iterate over every order matching filters, following pagination cursors"""
+        filters.setdefault('limit', 250)
+        async for order in self._iter_pages('/orders.json', 'orders', self._order_params(**filters)):
+            yield order
+    
+    async def mget_orders(self, order_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Get several orders by ID using one cache MGET and one API call for the misses"""
+        cache_keys = [f"shopify_order:{self.shop_domain}:{order_id}" for order_id in order_ids]
+        cached_orders = await cache_service.mget(cache_keys)
+        
+        orders = dict(zip(order_ids, cached_orders))
+        missing_ids = [order_id for order_id, order in orders.items() if not order]
+        
+        # Fetch all misses in one request (Shopify caps ids/limit at 250 per page)
+        for i in range(0, len(missing_ids), 250):
+            batch = missing_ids[i:i + 250]
+            response = await self.get('/orders.json', {
+                'ids': ','.join(str(order_id) for order_id in batch),
+                'status': 'any',
+                'limit': len(batch)
+            })
+            fetched = {str(order['id']): order for order in response.get('orders', [])}
+            
+            await cache_service.mset(
+                {f"shopify_order:{self.shop_domain}:{order_id}": order for order_id, order in fetched.items()},
+                cache_service.TTL_ORDER_CACHE
+            )
+            for order_id in batch:
+                orders[order_id] = fetched.get(str(order_id))
+        
+        return orders
+    
     async def update_order(self, order_id: str, order_data: Dict[str, Any]) -> Dict[str, Any]:
         """Update order"""
         data = {'order': order_data}
@@ -222,13 +373,10 @@ class ShopifyAPIClient:
             return cached_customer
         
         try:
-            response = await self.get(f'/customers/{customer_id}.json')
-            customer = response.get('customer', {})
-            
             # Cache for 10 minutes
-            await cache_service.cache_with_jitter(cache_key, customer, cache_service.TTL_ORDER_CACHE * 2)
-            
-            return customer
+            return await self._get_revalidated(
+                f'/customers/{customer_id}.json', 'customer', cache_key, cache_service.TTL_ORDER_CACHE * 2
+            )
         except ShopifyAPIException:
             return None
     
@@ -242,6 +390,12 @@ class ShopifyAPIClient:
         response = await self.get('/customers/search.json', params)
         return response.get('customers', [])
     
+    async def iter_customers(self, query: str, limit: int = 250) -> AsyncIterator[Dict[str, Any]]:
+        """Iterate over every customer matching a search query"""
+        params = {'query': query, 'limit': min(limit, 250)}
+        async for customer in self._iter_pages('/customers/search.json', 'customers', params):
+            yield customer
+    
     async def update_customer(self, customer_id: str, customer_data: Dict[str, Any]) -> Dict[str, Any]:
         """Update customer"""
         data = {'customer': customer_data}
@@ -264,13 +418,10 @@ class ShopifyAPIClient:
             return cached_product
         
         try:
-            response = await self.get(f'/products/{product_id}.json')
-            product = response.get('product', {})
-            
             # Cache for 30 minutes (products change less frequently)
-            await cache_service.cache_with_jitter(cache_key, product, cache_service.TTL_SHORT * 30)
-            
-            return product
+            return await self._get_revalidated(
+                f'/products/{product_id}.json', 'product', cache_key, cache_service.TTL_SHORT * 30
+            )
         except ShopifyAPIException:
             return None
     
@@ -284,6 +435,12 @@ class ShopifyAPIClient:
         response = await self.get('/products.json', params)
         return response.get('products', [])
     
+    async def iter_products(self, query: str, limit: int = 250) -> AsyncIterator[Dict[str, Any]]:
+        """Iterate over every product whose title matches query"""
+        params = {'title': query, 'limit': min(limit, 250)}
+        async for product in self._iter_pages('/products.json', 'products', params):
+            yield product
+    
     # Fulfillment methods
     async def get_fulfillments(self, order_id: str) -> List[Dict[str, Any]]:
         """Get fulfillments for an order"""
@@ -313,12 +470,24 @@ class ShopifyAPIClient:
         return await self.delete(f'/webhooks/{webhook_id}.json')
 
 
-def get_shopify_client(merchant) -> ShopifyAPIClient:
-    """Factory function to create Shopify client for merchant"""
-    if not merchant.shopify_access_token or not merchant.shopify_shop_domain:
+# API clients reused across requests, keyed by (shop_domain, access_token)
+_api_clients: Dict[Tuple[str, str], 'ShopifyAPIClient'] = {}
+_MAX_API_CLIENTS = 1024
+
+
+def get_shopify_client(shop_domain: str, access_token: str) -> ShopifyAPIClient:
+    """Get the shared Shopify client for a shop's credentials, creating it on first use"""
+    if not access_token or not shop_domain:
         raise ShopifyAPIException("Missing Shopify credentials for merchant")
     
-    return ShopifyAPIClient(
-        shop_domain=merchant.shopify_shop_domain,
-        access_token=merchant.shopify_access_token
-    )
\ No newline at end of file
+    key = (shop_domain, access_token)
+    client = _api_clients.get(key)
+    if client is None:
+        if len(_api_clients) >= _MAX_API_CLIENTS:
+            # Evict the oldest entry (e.g. a rotated token)
+            del _api_clients[next(iter(_api_clients))]
+        client = _api_clients[key] = ShopifyAPIClient(
+            shop_domain=shop_domain,
+            access_token=access_token
+        )
+    return client
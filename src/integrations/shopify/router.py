@@ -1,25 +1,40 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Response, status, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple, Callable, List
+from pydantic import BaseModel, Field
 from urllib.parse import parse_qs
-import uuid
+from types import SimpleNamespace
+import asyncio
+import secrets
+import sys
+import time
+import orjson
+from jose import JWTError, jwt
 from loguru import logger
 
 from .auth import shopify_oauth
 from .webhooks import (
-    verify_webhook_request, extract_webhook_metadata, process_webhook_async,
+    new_webhook_mac, verify_webhook_mac, extract_webhook_metadata, process_webhook_async,
     handle_order_created, handle_order_updated, handle_order_fulfilled,
-    handle_customer_created, handle_app_uninstalled
+    handle_customer_created, handle_app_uninstalled,
+    invalidate_merchant_cache, MERCHANT_CACHE_TTL, UNKNOWN_MERCHANT_CACHE_TTL, WEBHOOK_HMAC_OFFLOAD_BYTES
 )
 from .client import get_shopify_client
 from ...auth.dependencies import get_current_user
+from ...core.config import settings
 from ...core.database import get_db
 from ...core.models import Merchant
 from ...core.exceptions import ShopifyAPIException, ValidationException
 from ...core.cache import cache_service
 
 
-router = APIRouter(prefix="/shopify", tags=["Shopify Integration"])
+OAUTH_STATE_TTL = 600  # 10 minutes
+MAX_BATCH_SIZE = 50
+
+router = APIRouter(prefix="/shopify", tags=["Shopify Integration"], default_response_class=ORJSONResponse)
 
 
 @router.get("/auth/install")
@@ -34,16 +49,17 @@ async def initiate_shopify_install(
         if not shop or len(shop) < 3:
             raise ValidationException("Invalid shop domain")
         
-        # Generate CSRF state token
-        state = str(uuid.uuid4())
-        
-        # Store state in cache for verification (expires in 10 minutes)
-        state_data = {
-            "user_id": current_user.id,
-            "shop": shop,
-            "timestamp": "current_time"
-        }
-        await cache_service.set_with_expire(f"shopify_oauth_state:{state}", state_data, 600)
+        # Generate a signed, self-contained CSRF state token (expires in 10 minutes)
+        state = jwt.encode(
+            {
+                "uid": current_user.id,
+                "shop": shop,
+                "exp": int(time.time()) + OAUTH_STATE_TTL,
+                "nonce": secrets.token_urlsafe(12)
+            },
+            settings.secret_key,
+            algorithm=settings.algorithm
+        )
         
         # Generate authorization URL
         auth_url, csrf_state = shopify_oauth.generate_auth_url(shop, state=state)
@@ -75,16 +91,16 @@ async def shopify_oauth_callback(
     """Handle Shopify OAuth callback"""
     try:
         # Verify HMAC signature
-        query_string = str(request.url.query)
-        if not shopify_oauth.verify_installation_request(query_string):
+        if not shopify_oauth.verify_installation_request(request.scope["query_string"]):
             raise ValidationException("Invalid installation request signature")
         
-        # Verify state token
-        state_data = await cache_service.get(f"shopify_oauth_state:{state}")
-        if not state_data:
+        # Verify state token signature and expiry
+        try:
+            state_data = jwt.decode(state, settings.secret_key, algorithms=[settings.algorithm])
+        except JWTError:
             raise ValidationException("Invalid or expired state token")
         
-        user_id = state_data["user_id"]
+        user_id = state_data["uid"]
         expected_shop = state_data["shop"]
         
         # Verify shop matches
@@ -99,64 +115,44 @@ async def shopify_oauth_callback(
         if not shop_info:
             raise ShopifyAPIException("Failed to retrieve shop information")
         
-        # Create or update merchant record
-        from sqlalchemy import select, update
-        
-        # Check if merchant already exists
-        existing_merchant = await db.execute(
-            select(Merchant).where(
-                Merchant.shopify_shop_domain == shop,
-                Merchant.platform_type == "shopify"
-            )
+        # Create or update merchant record in a single round trip
+        merchant_stmt = pg_insert(Merchant).values(
+            name=shop_info.get("name", shop),
+            email=shop_info.get("email", ""),
+            phone=shop_info.get("phone"),
+            website=shop_info.get("domain"),
+            platform_type="shopify",
+            platform_domain=shop,
+            shopify_shop_domain=shop,
+            shopify_access_token=token_data["access_token"],
+            is_active=True
         )
-        merchant = existing_merchant.scalar_one_or_none()
-        
-        if merchant:
-            # Update existing merchant
-            await db.execute(
-                update(Merchant)
-                .where(Merchant.id == merchant.id)
-                .values(
-                    shopify_access_token=token_data["access_token"],
-                    is_active=True,
-                    name=shop_info.get("name", merchant.name),
-                    email=shop_info.get("email", merchant.email),
-                    phone=shop_info.get("phone", merchant.phone),
-                    website=shop_info.get("domain", merchant.website)
-                )
-            )
-            await db.commit()
-            
-            logger.info(f"Updated existing Shopify merchant: {shop}")
-        else:
-            # Create new merchant
-            merchant = Merchant(
-                name=shop_info.get("name", shop),
-                email=shop_info.get("email", ""),
-                phone=shop_info.get("phone"),
-                website=shop_info.get("domain"),
-                platform_type="shopify",
-                platform_domain=shop,
-                shopify_shop_domain=shop,
-                shopify_access_token=token_data["access_token"],
-                is_active=True
-            )
-            
-            db.add(merchant)
-            await db.commit()
-            await db.refresh(merchant)
-            
-            logger.info(f"Created new Shopify merchant: {shop}")
-        
-        # Set up required webhooks
+        # On reinstall only overwrite profile fields Shopify actually returned
+        update_values = {
+            "shopify_access_token": merchant_stmt.excluded.shopify_access_token,
+            "is_active": True,
+        }
+        for shop_field, column in (("name", "name"), ("email", "email"), ("phone", "phone"), ("domain", "website")):
+            if shop_field in shop_info:
+                update_values[column] = merchant_stmt.excluded[column]
+        
+        merchant_stmt = merchant_stmt.on_conflict_do_update(
+            index_elements=["shopify_shop_domain", "platform_type"],
+            set_=update_values
+        ).returning(Merchant).execution_options(populate_existing=True)
+        
+        merchant = (await db.execute(merchant_stmt)).scalar_one()
+        await db.commit()
+        
+        logger.info(f"Created or updated Shopify merchant: {shop}")
+        
+        # Set up required webhooks while the stale merchant cache is dropped
         webhook_base_url = f"https://yourdomain.com{request.url.path.replace('/auth/callback', '')}"
-        webhook_results = await shopify_oauth.setup_required_webhooks(
-            shop, token_data["access_token"], webhook_base_url
+        _, webhook_results = await asyncio.gather(
+            invalidate_merchant_cache(merchant.id, shop),
+            shopify_oauth.setup_required_webhooks(shop, token_data["access_token"], webhook_base_url)
         )
         
-        # Clean up state token
-        await cache_service.delete(f"shopify_oauth_state:{state}")
-        
         # Return success response with merchant info
         return {
             "status": "success",
@@ -175,53 +171,76 @@ async def shopify_oauth_callback(
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="OAuth callback failed")
 
 
-# Webhook endpoints
-@router.post("/webhooks/orders_create")
-async def webhook_orders_create(request: Request, db: AsyncSession = Depends(get_db)):
-    """Handle order created webhook"""
-    return await process_webhook("orders/create", request, db, handle_order_created)
+# Webhook endpoints: URL segment -> (Shopify topic, handler), keys interned for lookup
+WEBHOOK_HANDLERS: Dict[str, Tuple[str, Callable]] = {sys.intern(k): v for k, v in {
+    "orders_create": ("orders/create", handle_order_created),
+    "orders_updated": ("orders/updated", handle_order_updated),
+    "orders_paid": ("orders/paid", handle_order_updated),
+    "orders_cancelled": ("orders/cancelled", handle_order_updated),
+    "orders_fulfilled": ("orders/fulfilled", handle_order_fulfilled),
+    "customers_create": ("customers/create", handle_customer_created),
+    "customers_update": ("customers/update", handle_customer_created),
+    "app_uninstalled": ("app/uninstalled", handle_app_uninstalled),
+}.items()}
 
 
-@router.post("/webhooks/orders_updated")
-async def webhook_orders_updated(request: Request, db: AsyncSession = Depends(get_db)):
-    """Handle order updated webhook"""
-    return await process_webhook("orders/updated", request, db, handle_order_updated)
+@router.post("/webhooks/{topic}")
+async def webhook_entry(topic: str, request: Request, db: AsyncSession = Depends(get_db)):
+    """Handle a Shopify webhook for any subscribed topic"""
+    entry = WEBHOOK_HANDLERS.get(sys.intern(topic))
+    if entry is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown webhook topic")
+    
+    webhook_type, handler_func = entry
+    return await process_webhook(webhook_type, request, db, handler_func)
 
 
-@router.post("/webhooks/orders_paid")
-async def webhook_orders_paid(request: Request, db: AsyncSession = Depends(get_db)):
-    """Handle order paid webhook"""
-    return await process_webhook("orders/paid", request, db, handle_order_updated)
-
-
-@router.post("/webhooks/orders_cancelled")
-async def webhook_orders_cancelled(request: Request, db: AsyncSession = Depends(get_db)):
-    """Handle order cancelled webhook"""
-    return await process_webhook("orders/cancelled", request, db, handle_order_updated)
-
-
-@router.post("/webhooks/orders_fulfilled")
-async def webhook_orders_fulfilled(request: Request, db: AsyncSession = Depends(get_db)):
-    """Handle order fulfilled webhook"""
-    return await process_webhook("orders/fulfilled", request, db, handle_order_fulfilled)
-
-
-@router.post("/webhooks/customers_create")
-async def webhook_customers_create(request: Request, db: AsyncSession = Depends(get_db)):
-    """Handle customer created webhook"""
-    return await process_webhook("customers/create", request, db, handle_customer_created)
-
-
-@router.post("/webhooks/customers_update")
-async def webhook_customers_update(request: Request, db: AsyncSession = Depends(get_db)):
-    """Handle customer updated webhook"""
-    return await process_webhook("customers/update", request, db, handle_customer_created)
+async def get_webhook_merchant(db: AsyncSession, shop_domain: str):
+    """Resolve the active merchant (id + webhook secret) for a shop, cached in Redis"""
+    cache_key = f"shopify_merchant:{shop_domain}"
+    cached = await cache_service.get(cache_key)
+    if cached:
+        # Unknown shops are cached too (id None), so floods of forged domains stay off the DB
+        if cached["id"] is None:
+            return None
+        return SimpleNamespace(id=cached["id"], shopify_webhook_secret=cached["secret"])
+    
+    # Project only the two columns needed; a Row skips ORM hydration and the identity map
+    merchant_result = await db.execute(
+        select(Merchant.id, Merchant.shopify_webhook_secret).where(
+            Merchant.shopify_shop_domain == shop_domain,
+            Merchant.platform_type == "shopify",
+            Merchant.is_active.is_(True)
+        )
+    )
+    merchant = merchant_result.one_or_none()
+    
+    if merchant:
+        await cache_service.set_with_expire(
+            cache_key,
+            {"id": merchant.id, "secret": merchant.shopify_webhook_secret},
+            MERCHANT_CACHE_TTL
+        )
+    else:
+        await cache_service.set_with_expire(cache_key, {"id": None}, UNKNOWN_MERCHANT_CACHE_TTL)
+    return merchant
 
 
-@router.post("/webhooks/app_uninstalled")
-async def webhook_app_uninstalled(request: Request, db: AsyncSession = Depends(get_db)):
-    """Handle app uninstalled webhook"""
-    return await process_webhook("app/uninstalled", request, db, handle_app_uninstalled)
+async def get_api_merchant(db: AsyncSession, merchant_id: int) -> Optional[Tuple[str, str]]:
+    """Resolve an active merchant's (shop_domain, access_token) by ID"""
+    # Loaded from the DB on every call so the access token never sits in the shared cache;
+    # projecting the two columns keeps this a cheap primary-key lookup
+    merchant_result = await db.execute(
+        select(Merchant.shopify_shop_domain, Merchant.shopify_access_token).where(
+            Merchant.id == merchant_id,
+            Merchant.platform_type == "shopify",
+            Merchant.is_active == True
+        ).limit(1)
+    )
+    row = merchant_result.one_or_none()
+    if row is None:
+        return None
+    return row.shopify_shop_domain, row.shopify_access_token
 
 
 async def process_webhook(webhook_type: str, request: Request, db: AsyncSession, handler_func):
@@ -235,41 +254,51 @@ async def process_webhook(webhook_type: str, request: Request, db: AsyncSession,
             logger.warning("Missing shop domain in webhook headers")
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Missing shop domain")
         
-        # Find merchant by shop domain
-        from sqlalchemy import select
-        merchant_result = await db.execute(
-            select(Merchant).where(
-                Merchant.shopify_shop_domain == shop_domain,
-                Merchant.platform_type == "shopify",
-                Merchant.is_active == True
-            )
-        )
-        merchant = merchant_result.scalar_one_or_none()
+        hmac_header = metadata.get("hmac")
+        if not hmac_header:
+            logger.warning("Missing X-Shopify-Hmac-SHA256 header")
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid webhook signature")
         
-        if not merchant:
-            logger.warning(f"Merchant not found for shop: {shop_domain}")
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Merchant not found")
+        # Resolve the merchant (cache, then indexed DB lookup) before choosing the signing
+        # secret: the merchant's own secret takes precedence over the app-wide one
+        merchant = await get_webhook_merchant(db, shop_domain)
+        
+        mac = new_webhook_mac(merchant.shopify_webhook_secret if merchant else None)
+        if mac is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid webhook signature")
         
-        # Verify webhook signature
-        is_valid = await verify_webhook_request(request, merchant.shopify_webhook_secret)
-        if not is_valid:
+        # Hash the body while it streams in, accumulating into a single bytearray
+        body = bytearray()
+        async for chunk in request.stream():
+            body.extend(chunk)
+            if len(chunk) > WEBHOOK_HMAC_OFFLOAD_BYTES:
+                await asyncio.get_running_loop().run_in_executor(None, mac.update, chunk)
+            else:
+                mac.update(chunk)
+        
+        if not verify_webhook_mac(mac, hmac_header):
             logger.warning(f"Invalid webhook signature from {shop_domain}")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid webhook signature")
         
-        # Parse webhook payload
-        payload = await request.json()
+        if not merchant:
+            logger.warning(f"Merchant not found for shop: {shop_domain}")
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Merchant not found")
+        
+        # Parse webhook payload from the bytes already read for verification
+        payload = orjson.loads(body)
         
         # Log webhook receipt
-        logger.info(f"Received Shopify webhook: {webhook_type} from {shop_domain}")
+        logger.info("Received Shopify webhook: {} from {}", webhook_type, shop_domain)
         
-        # Process webhook asynchronously
+        # Acknowledge-then-process: the only work on the request path is a durable
+        # enqueue (one LPUSH), so a failed enqueue still surfaces as a 5xx and Shopify retries
         success = await process_webhook_async(webhook_type, payload, metadata, merchant.id)
         
         if not success:
             logger.error(f"Failed to queue webhook: {webhook_type}")
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Webhook processing failed")
         
-        return Response(status_code=200)
+        return Response(status_code=status.HTTP_202_ACCEPTED)
         
     except HTTPException:
         raise
@@ -279,6 +308,51 @@ async def process_webhook(webhook_type: str, request: Request, db: AsyncSession,
 
 
 # API endpoints for merchant management
+class OrdersBatchItem(BaseModel):
+    merchant_id: int
+    limit: int = Field(50, le=250)
+    status: Optional[str] = None
+
+
+@router.post("/merchants/orders/batch")
+async def get_merchant_orders_batch(
+    items: List[OrdersBatchItem],
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get orders for several Shopify merchants in one request"""
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Batch size exceeds {MAX_BATCH_SIZE}"
+        )
+    
+    # Resolve each merchant once; the session is not safe for concurrent use
+    credentials = {}
+    for merchant_id in dict.fromkeys(item.merchant_id for item in items):
+        credentials[merchant_id] = await get_api_merchant(db, merchant_id)
+    
+    async def fetch(item: OrdersBatchItem) -> Dict[str, Any]:
+        merchant_credentials = credentials[item.merchant_id]
+        if not merchant_credentials:
+            return {"merchant_id": item.merchant_id, "error": "Merchant not found"}
+        
+        try:
+            client = get_shopify_client(*merchant_credentials)
+            orders = await client.get_orders(status=item.status, limit=item.limit)
+            return {"orders": orders, "count": len(orders), "merchant_id": item.merchant_id}
+        except ShopifyAPIException as e:
+            return {"merchant_id": item.merchant_id, "error": str(e)}
+        except Exception as e:
+            logger.error(f"Error getting orders for merchant {item.merchant_id}: {e}")
+            return {"merchant_id": item.merchant_id, "error": "Failed to get orders"}
+    
+    # Fan out the Shopify calls concurrently
+    results = await asyncio.gather(*(fetch(item) for item in items))
+    
+    return {"results": results, "count": len(results)}
+
+
 @router.get("/merchants/{merchant_id}/orders")
 async def get_merchant_orders(
     merchant_id: int,
@@ -289,22 +363,14 @@ async def get_merchant_orders(
 ):
     """Get orders for a Shopify merchant"""
     try:
-        # Get merchant
-        from sqlalchemy import select
-        merchant_result = await db.execute(
-            select(Merchant).where(
-                Merchant.id == merchant_id,
-                Merchant.platform_type == "shopify",
-                Merchant.is_active == True
-            )
-        )
-        merchant = merchant_result.scalar_one_or_none()
+        # Get merchant credentials
+        credentials = await get_api_merchant(db, merchant_id)
         
-        if not merchant:
+        if not credentials:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Merchant not found")
         
         # Create Shopify client
-        client = get_shopify_client(merchant)
+        client = get_shopify_client(*credentials)
         
         # Get orders from Shopify
         orders = await client.get_orders(status=status, limit=limit)
@@ -331,22 +397,14 @@ async def get_merchant_order(
 ):
     """Get specific order for a Shopify merchant"""
     try:
-        # Get merchant
-        from sqlalchemy import select
-        merchant_result = await db.execute(
-            select(Merchant).where(
-                Merchant.id == merchant_id,
-                Merchant.platform_type == "shopify",
-                Merchant.is_active == True
-            )
-        )
-        merchant = merchant_result.scalar_one_or_none()
+        # Get merchant credentials
+        credentials = await get_api_merchant(db, merchant_id)
         
-        if not merchant:
+        if not credentials:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Merchant not found")
         
         # Create Shopify client
-        client = get_shopify_client(merchant)
+        client = get_shopify_client(*credentials)
         
         # Get order from Shopify
         order = await client.get_order(order_id)
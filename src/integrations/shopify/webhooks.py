@@ -1,8 +1,13 @@
+import asyncio
 import base64
+import binascii
 import hmac
 import hashlib
+import time
 import json
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple, Callable, FrozenSet
+from functools import lru_cache
+from types import SimpleNamespace
 from datetime import datetime
 from fastapi import Request, HTTPException
 from loguru import logger
@@ -10,79 +15,133 @@ from loguru import logger
 from ...core.config import settings
 from ...core.exceptions import ShopifyAPIException
 from ...core.queue import async_queue, QueueTask, QueuePriority
+from ...core.cache import cache_service
 
 
-def verify_webhook_signature(data: bytes, hmac_header: str, secret: str) -> bool:
-    """Verify Shopify webhook HMAC signature"""
-    try:
-        if not hmac_header or not secret:
-            logger.warning("Missing HMAC header or webhook secret")
-            return False
-        
-        # Calculate expected HMAC
-        digest = hmac.new(
-            secret.encode('utf-8'),
-            data,
-            hashlib.sha256
-        ).digest()
-        computed_hmac = base64.b64encode(digest)
-        
-        # Compare with provided HMAC
-        is_valid = hmac.compare_digest(computed_hmac, hmac_header.encode('utf-8'))
-        
-        if not is_valid:
-            logger.warning("Invalid webhook signature")
-        
-        return is_valid
-        
-    except Exception as e:
-        logger.error(f"Error verifying webhook signature: {e}")
-        return False
+# Merchant lookups cached in Redis (see router.process_webhook / merchant endpoints)
+MERCHANT_CACHE_TTL = 300  # 5 minutes
+UNKNOWN_MERCHANT_CACHE_TTL = 60  # shops with no active merchant; installs invalidate it
+
+# Bodies (or streamed chunks) above this size are hashed in a worker thread
+WEBHOOK_HMAC_OFFLOAD_BYTES = 64 * 1024
+
+
+# Shared read-only fallback for absent/null nested payload objects
+_EMPTY_DICT: Dict[str, Any] = {}
+
+# Topics queued ahead of the rest
+HIGH_PRIORITY_TOPICS: FrozenSet[str] = frozenset({"orders/create", "orders/paid", "checkouts/create"})
+
+# Queue partitions, so slow topics can't hold up order processing; each gets its own workers
+WEBHOOK_QUEUE_HIGH = "webhooks.high"
+WEBHOOK_QUEUE_NORMAL = "webhooks.normal"
+HIGH_QUEUE_TOPICS: FrozenSet[str] = frozenset({"orders/create", "orders/paid", "orders/fulfilled"})
+
+# Per-process merchant rows for webhook handlers: merchant_id -> (expires_at, merchant)
+LOCAL_MERCHANT_CACHE_TTL = 60.0
+_MAX_LOCAL_MERCHANTS = 1024
+_merchant_cache: Dict[int, Tuple[float, SimpleNamespace]] = {}
+
+
+async def invalidate_merchant_cache(merchant_id: int, shop_domain: str = None):
+    """Drop cached merchant lookups after the merchant record changes"""
+    _merchant_cache.pop(merchant_id, None)
+    if shop_domain:
+        await cache_service.delete(f"shopify_merchant:{shop_domain}")
 
 
-async def verify_webhook_request(request: Request, merchant_webhook_secret: str = None) -> bool:
-    """Verify incoming webhook request"""
+async def get_merchant_cached(db, merchant_id: int, ttl: float = LOCAL_MERCHANT_CACHE_TTL) -> Optional[SimpleNamespace]:
+    """Get a detached copy of a merchant's fields, cached in-process for ttl seconds"""
+    entry = _merchant_cache.get(merchant_id)
+    now = time.monotonic()
+    if entry and entry[0] > now:
+        return entry[1]
+    
+    from ...core.models import Merchant
+    from sqlalchemy import select
+    
+    merchant_result = await db.execute(
+        select(Merchant.id, Merchant.name, Merchant.is_active).where(Merchant.id == merchant_id)
+    )
+    row = merchant_result.one_or_none()
+    if row is None:
+        _merchant_cache.pop(merchant_id, None)
+        return None
+    
+    if merchant_id not in _merchant_cache and len(_merchant_cache) >= _MAX_LOCAL_MERCHANTS:
+        # Evict the oldest entry
+        del _merchant_cache[next(iter(_merchant_cache))]
+    merchant = SimpleNamespace(**row._asdict())
+    _merchant_cache[merchant_id] = (now + ttl, merchant)
+    return merchant
+
+
+@lru_cache(maxsize=1024)
+def _hmac_template(secret: str) -> "hmac.HMAC":
+    """Keyed HMAC-SHA256 for a secret; copying it skips the per-message key setup"""
+    return hmac.new(secret.encode('utf-8'), None, hashlib.sha256)
+
+
+def _decode_hmac_header(hmac_header: str) -> Optional[bytes]:
+    """Decode the base64 X-Shopify-Hmac-SHA256 header into the raw digest"""
     try:
-        # Get HMAC header
-        hmac_header = request.headers.get('X-Shopify-Hmac-SHA256')
-        if not hmac_header:
-            logger.warning("Missing X-Shopify-Hmac-SHA256 header")
-            return False
-        
-        # Get raw body data
-        body = await request.body()
-        
-        # Use merchant-specific secret or global secret
-        secret = merchant_webhook_secret or settings.shopify_webhook_secret
-        if not secret:
-            logger.error("No webhook secret configured")
-            return False
-        
-        return verify_webhook_signature(body, hmac_header, secret)
-        
-    except Exception as e:
-        logger.error(f"Error verifying webhook request: {e}")
+        return base64.b64decode(hmac_header, validate=True)
+    except (binascii.Error, ValueError):
+        logger.warning("Malformed webhook HMAC header")
+        return None
+
+
+def new_webhook_mac(merchant_webhook_secret: str = None) -> Optional["hmac.HMAC"]:
+    """Start an incremental HMAC for a webhook body streamed in chunks"""
+    secret = merchant_webhook_secret or settings.shopify_webhook_secret
+    if not secret:
+        logger.error("No webhook secret configured")
+        return None
+    
+    return _hmac_template(secret).copy()
+
+
+def verify_webhook_mac(mac: "hmac.HMAC", hmac_header: str) -> bool:
+    """Check a fed incremental HMAC against the X-Shopify-Hmac-SHA256 header"""
+    provided = _decode_hmac_header(hmac_header)
+    if provided is None:
         return False
+    
+    is_valid = hmac.compare_digest(mac.digest(), provided)
+    
+    if not is_valid:
+        logger.warning("Invalid webhook signature")
+    
+    return is_valid
+
+
+# Raw (lowercased, as ASGI delivers them) webhook header names -> metadata keys
+_WEBHOOK_HEADERS: Dict[bytes, str] = {
+    b'x-shopify-shop-domain': 'shop_domain',
+    b'x-shopify-topic': 'topic',
+    b'x-shopify-webhook-id': 'webhook_id',
+    b'x-shopify-api-version': 'api_version',
+    b'x-shopify-hmac-sha256': 'hmac',
+    b'x-shopify-triggered-at': 'triggered_at',
+}
 
 
 def extract_webhook_metadata(request: Request) -> Dict[str, str]:
-    """Extract metadata from webhook headers"""
-    return {
-        'shop_domain': request.headers.get('X-Shopify-Shop-Domain', ''),
-        'topic': request.headers.get('X-Shopify-Topic', ''),
-        'webhook_id': request.headers.get('X-Shopify-Webhook-Id', ''),
-        'api_version': request.headers.get('X-Shopify-API-Version', ''),
-        'hmac': request.headers.get('X-Shopify-Hmac-SHA256', ''),
-        'triggered_at': request.headers.get('X-Shopify-Triggered-At', ''),
-    }
+    """Extract metadata from webhook headers in a single pass over the raw ASGI headers"""
+    metadata = dict.fromkeys(_WEBHOOK_HEADERS.values(), '')
+    for name, value in request.scope['headers']:
+        key = _WEBHOOK_HEADERS.get(name)
+        if key:
+            metadata[key] = value.decode('latin-1')
+    return metadata
 
 
 async def process_webhook_async(webhook_type: str, payload: Dict[str, Any], metadata: Dict[str, str], merchant_id: int):
     """Queue webhook for asynchronous processing"""
     try:
         task = QueueTask(
-            id=f"shopify_webhook_{metadata.get('webhook_id', 'unknown')}_{datetime.utcnow().timestamp()}",
-            queue_name="webhooks",
+            id=f"shopify_webhook_{metadata.get('webhook_id', 'unknown')}_{time.time_ns()}",
+            queue_name=WEBHOOK_QUEUE_HIGH if webhook_type in HIGH_QUEUE_TOPICS else WEBHOOK_QUEUE_NORMAL,
             task_type="webhook.process",
             payload={
                 "type": f"shopify.{webhook_type}",
@@ -90,13 +149,13 @@ async def process_webhook_async(webhook_type: str, payload: Dict[str, Any], meta
                 "metadata": metadata,
                 "merchant_id": merchant_id
             },
-            priority=QueuePriority.HIGH if webhook_type in ["orders/create", "orders/paid"] else QueuePriority.NORMAL,
+            priority=QueuePriority.HIGH if webhook_type in HIGH_PRIORITY_TOPICS else QueuePriority.NORMAL,
             max_retries=3
         )
         
         success = await async_queue.enqueue(task)
         if success:
-            logger.info(f"Queued Shopify webhook {webhook_type} for processing")
+            logger.info("Queued Shopify webhook {} for processing", webhook_type)
         else:
             logger.error(f"Failed to queue Shopify webhook {webhook_type}")
             
@@ -107,6 +166,37 @@ async def process_webhook_async(webhook_type: str, payload: Dict[str, Any], meta
         return False
 
 
+async def _upsert_order_customer(db, merchant_id: int, order_data: Dict[str, Any], order_info: Dict[str, Any]):
+    """Find or create an order's customer in one race-safe round trip; returns (id, whatsapp_id)"""
+    if not order_info['customer_email']:
+        return None
+    
+    from ...core.models import Customer
+    from sqlalchemy import func
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+    
+    customer_data = order_data.get('customer') or _EMPTY_DICT
+    first_name = customer_data.get('first_name')
+    last_name = customer_data.get('last_name')
+    customer_stmt = pg_insert(Customer).values(
+        merchant_id=merchant_id,
+        external_id=str(customer_data.get('id', '')),
+        email=order_info['customer_email'],
+        phone_number=order_info['customer_phone'],
+        first_name=first_name,
+        last_name=last_name,
+        full_name=f"{first_name or ''} {last_name or ''}".strip()
+    )
+    # Refresh the phone on conflict (so RETURNING also yields an existing customer) and
+    # return only what the order needs; the statement shape is fixed, so SQLAlchemy's
+    # compiled cache and asyncpg's prepared-statement cache are reused across webhooks
+    customer_stmt = customer_stmt.on_conflict_do_update(
+        index_elements=["merchant_id", "email"],
+        set_={"phone_number": func.coalesce(customer_stmt.excluded.phone_number, Customer.phone_number)}
+    ).returning(Customer.id, Customer.whatsapp_id)
+    return (await db.execute(customer_stmt)).one()
+
+
 # Webhook handlers
 async def handle_order_created(payload: Dict[str, Any], merchant_id: int) -> Dict[str, Any]:
     """Handle order created webhook"""
@@ -115,9 +205,11 @@ async def handle_order_created(payload: Dict[str, Any], merchant_id: int) -> Dic
         order_id = order_data.get('id')
         order_number = order_data.get('order_number', order_data.get('name', ''))
         
-        logger.info(f"Processing order created: {order_number} (ID: {order_id})")
+        logger.info("Processing order created: {} (ID: {})", order_number, order_id)
         
         # Extract order information
+        created_at = order_data.get('created_at')
+        billing_address = order_data.get('billing_address') or _EMPTY_DICT
         order_info = {
             'external_order_id': str(order_id),
             'order_number': order_number,
@@ -128,80 +220,62 @@ async def handle_order_created(payload: Dict[str, Any], merchant_id: int) -> Dic
             'currency': order_data.get('currency', 'USD'),
             'customer_email': order_data.get('email'),
             'customer_phone': order_data.get('phone'),
-            'customer_name': f"{order_data.get('billing_address', {}).get('first_name', '')} {order_data.get('billing_address', {}).get('last_name', '')}".strip(),
+            'customer_name': f"{billing_address.get('first_name') or ''} {billing_address.get('last_name') or ''}".strip(),
             'shipping_address': order_data.get('shipping_address', {}),
             'order_data': order_data,
-            'order_date': datetime.fromisoformat(order_data.get('created_at', '').replace('Z', '+00:00')) if order_data.get('created_at') else None
+            # Python 3.11+ parses the trailing 'Z' natively
+            'order_date': datetime.fromisoformat(created_at) if created_at else None
         }
         
         # Store order in database
         from ...core.database import AsyncSessionLocal
-        from ...core.models import Order, Customer, Merchant
-        from sqlalchemy import select
+        from ...core.models import Order
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        
+        async def load_merchant():
+            # Own session: an AsyncSession can't run two statements concurrently
+            async with AsyncSessionLocal() as merchant_db:
+                return await get_merchant_cached(merchant_db, merchant_id)
         
         async with AsyncSessionLocal() as db:
-            # Get merchant
-            merchant_result = await db.execute(select(Merchant).where(Merchant.id == merchant_id))
-            merchant = merchant_result.scalar_one_or_none()
+            # Get merchant and find-or-create the customer concurrently
+            merchant, customer = await asyncio.gather(
+                load_merchant(),
+                _upsert_order_customer(db, merchant_id, order_data, order_info),
+                return_exceptions=True
+            )
+            if isinstance(merchant, BaseException):
+                raise merchant
             
             if not merchant:
                 logger.error(f"Merchant not found: {merchant_id}")
                 return {"status": "error", "message": "Merchant not found"}
             
-            # Find or create customer
-            customer = None
-            if order_info['customer_email']:
-                customer_result = await db.execute(
-                    select(Customer).where(
-                        Customer.merchant_id == merchant_id,
-                        Customer.email == order_info['customer_email']
-                    )
-                )
-                customer = customer_result.scalar_one_or_none()
-                
-                if not customer:
-                    # Create new customer
-                    customer_data = order_data.get('customer', {})
-                    customer = Customer(
-                        merchant_id=merchant_id,
-                        external_id=str(customer_data.get('id', '')),
-                        email=order_info['customer_email'],
-                        phone_number=order_info['customer_phone'],
-                        first_name=customer_data.get('first_name'),
-                        last_name=customer_data.get('last_name'),
-                        full_name=f"{customer_data.get('first_name', '')} {customer_data.get('last_name', '')}".strip()
-                    )
-                    db.add(customer)
-                    await db.flush()
-            
-            # Check if order already exists
-            existing_order = await db.execute(
-                select(Order).where(
-                    Order.merchant_id == merchant_id,
-                    Order.external_order_id == order_info['external_order_id']
-                )
-            )
-            
-            if existing_order.scalar_one_or_none():
-                logger.info(f"Order already exists: {order_number}")
-                return {"status": "duplicate", "order_number": order_number}
+            if isinstance(customer, BaseException):
+                raise customer
             
-            # Create new order
-            new_order = Order(
+            # Insert the order unless it already exists
+            order_stmt = pg_insert(Order).values(
                 merchant_id=merchant_id,
                 customer_id=customer.id if customer else None,
                 **order_info
-            )
+            ).on_conflict_do_nothing(
+                index_elements=["merchant_id", "external_order_id"]
+            ).returning(Order.id)
+            new_order_id = (await db.execute(order_stmt)).scalar_one_or_none()
+            
+            if new_order_id is None:
+                logger.info("Order already exists: {}", order_number)
+                return {"status": "duplicate", "order_number": order_number}
             
-            db.add(new_order)
             await db.commit()
             
-            logger.info(f"Successfully stored order: {order_number}")
+            logger.info("Successfully stored order: {}", order_number)
             
             # Trigger order confirmation workflow
-            await trigger_order_confirmation(new_order, merchant, customer)
+            await trigger_order_confirmation(new_order_id, merchant, customer)
             
-            return {"status": "success", "order_id": new_order.id, "order_number": order_number}
+            return {"status": "success", "order_id": new_order_id, "order_number": order_number}
             
     except Exception as e:
         logger.error(f"Error processing order created webhook: {e}")
@@ -215,21 +289,22 @@ async def handle_order_updated(payload: Dict[str, Any], merchant_id: int) -> Dic
         order_id = str(order_data.get('id'))
         order_number = order_data.get('order_number', order_data.get('name', ''))
         
-        logger.info(f"Processing order updated: {order_number}")
+        logger.info("Processing order updated: {}", order_number)
         
         from ...core.database import AsyncSessionLocal
         from ...core.models import Order
         from sqlalchemy import select, update
         
         async with AsyncSessionLocal() as db:
-            # Find existing order
+            # Find existing order; only the columns the update compares against, not the
+            # (large) stored order_data JSON
             result = await db.execute(
-                select(Order).where(
+                select(Order.id, Order.status, Order.total_amount, Order.fulfillment_status).where(
                     Order.merchant_id == merchant_id,
                     Order.external_order_id == order_id
                 )
             )
-            existing_order = result.scalar_one_or_none()
+            existing_order = result.one_or_none()
             
             if not existing_order:
                 logger.warning(f"Order not found for update: {order_number}")
@@ -262,7 +337,7 @@ async def handle_order_updated(payload: Dict[str, Any], merchant_id: int) -> Dic
             )
             await db.commit()
             
-            logger.info(f"Successfully updated order: {order_number}")
+            logger.info("Successfully updated order: {}", order_number)
             
             # Trigger status update notifications
             await trigger_order_status_update(existing_order, update_data)
@@ -280,7 +355,7 @@ async def handle_order_fulfilled(payload: Dict[str, Any], merchant_id: int) -> D
         order_data = payload
         order_id = str(order_data.get('id'))
         
-        logger.info(f"Processing order fulfilled: {order_id}")
+        logger.info("Processing order fulfilled: {}", order_id)
         
         # Update order fulfillment status
         result = await handle_order_updated(payload, merchant_id)
@@ -302,42 +377,55 @@ async def handle_customer_created(payload: Dict[str, Any], merchant_id: int) ->
         customer_data = payload
         customer_id = str(customer_data.get('id'))
         
-        logger.info(f"Processing customer created: {customer_id}")
+        logger.info("Processing customer created: {}", customer_id)
         
         from ...core.database import AsyncSessionLocal
         from ...core.models import Customer
-        from sqlalchemy import select
+        from sqlalchemy import select, func
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
         
         async with AsyncSessionLocal() as db:
             # Check if customer already exists
-            existing_customer = await db.execute(
-                select(Customer).where(
+            customer_exists = await db.scalar(
+                select(1).where(
                     Customer.merchant_id == merchant_id,
                     Customer.external_id == customer_id
-                )
+                ).limit(1)
             )
             
-            if existing_customer.scalar_one_or_none():
-                logger.info(f"Customer already exists: {customer_id}")
+            if customer_exists:
+                logger.info("Customer already exists: {}", customer_id)
                 return {"status": "duplicate", "customer_id": customer_id}
             
-            # Create new customer
-            new_customer = Customer(
+            # Create the customer, or adopt the row an order webhook already stored for this email
+            first_name = customer_data.get('first_name')
+            last_name = customer_data.get('last_name')
+            customer_stmt = pg_insert(Customer).values(
                 merchant_id=merchant_id,
                 external_id=customer_id,
                 email=customer_data.get('email'),
                 phone_number=customer_data.get('phone'),
-                first_name=customer_data.get('first_name'),
-                last_name=customer_data.get('last_name'),
-                full_name=f"{customer_data.get('first_name', '')} {customer_data.get('last_name', '')}".strip()
+                first_name=first_name,
+                last_name=last_name,
+                full_name=f"{first_name or ''} {last_name or ''}".strip()
             )
-            
-            db.add(new_customer)
+            excluded = customer_stmt.excluded
+            customer_stmt = customer_stmt.on_conflict_do_update(
+                index_elements=["merchant_id", "email"],
+                set_={
+                    "external_id": excluded.external_id,
+                    "phone_number": func.coalesce(excluded.phone_number, Customer.phone_number),
+                    "first_name": func.coalesce(excluded.first_name, Customer.first_name),
+                    "last_name": func.coalesce(excluded.last_name, Customer.last_name),
+                    "full_name": func.coalesce(func.nullif(excluded.full_name, ''), Customer.full_name)
+                }
+            ).returning(Customer.id)
+            new_customer_id = (await db.execute(customer_stmt)).scalar_one()
             await db.commit()
             
-            logger.info(f"Successfully created customer: {customer_id}")
+            logger.info("Successfully created customer: {}", customer_id)
             
-            return {"status": "success", "customer_id": new_customer.id}
+            return {"status": "success", "customer_id": new_customer_id}
             
     except Exception as e:
         logger.error(f"Error processing customer created webhook: {e}")
@@ -347,7 +435,7 @@ async def handle_customer_created(payload: Dict[str, Any], merchant_id: int) ->
 async def handle_app_uninstalled(payload: Dict[str, Any], merchant_id: int) -> Dict[str, Any]:
     """Handle app uninstalled webhook"""
     try:
-        logger.info(f"Processing app uninstalled for merchant: {merchant_id}")
+        logger.info("Processing app uninstalled for merchant: {}", merchant_id)
         
         from ...core.database import AsyncSessionLocal
         from ...core.models import Merchant
@@ -362,7 +450,9 @@ async def handle_app_uninstalled(payload: Dict[str, Any], merchant_id: int) -> D
             )
             await db.commit()
             
-            logger.info(f"Deactivated merchant after app uninstall: {merchant_id}")
+            await invalidate_merchant_cache(merchant_id, payload.get('myshopify_domain'))
+            
+            logger.info("Deactivated merchant after app uninstall: {}", merchant_id)
             
             return {"status": "success", "merchant_id": merchant_id}
             
@@ -371,8 +461,21 @@ async def handle_app_uninstalled(payload: Dict[str, Any], merchant_id: int) -> D
         raise ShopifyAPIException(f"Failed to process uninstall: {str(e)}")
 
 
+# Queue worker dispatch: Shopify topic -> handler
+WEBHOOK_TOPIC_HANDLERS: Dict[str, Callable] = {
+    "orders/create": handle_order_created,
+    "orders/updated": handle_order_updated,
+    "orders/paid": handle_order_updated,
+    "orders/cancelled": handle_order_updated,
+    "orders/fulfilled": handle_order_fulfilled,
+    "customers/create": handle_customer_created,
+    "customers/update": handle_customer_created,
+    "app/uninstalled": handle_app_uninstalled,
+}
+
+
 # Notification triggers
-async def trigger_order_confirmation(order, merchant, customer):
+async def trigger_order_confirmation(order_id: int, merchant, customer):
     """Trigger order confirmation message to customer"""
     if not customer or not customer.whatsapp_id:
         return
@@ -381,13 +484,13 @@ async def trigger_order_confirmation(order, merchant, customer):
     from ...core.queue import QueueTask, QueuePriority
     
     task = QueueTask(
-        id=f"order_confirmation_{order.id}_{datetime.utcnow().timestamp()}",
+        id=f"order_confirmation_{order_id}_{time.time_ns()}",
         queue_name="notifications",
         task_type="whatsapp.send_message",
         payload={
             "recipient": customer.whatsapp_id,
             "template": "order_confirmation",
-            "order_id": order.id,
+            "order_id": order_id,
             "merchant_id": merchant.id
         },
         priority=QueuePriority.HIGH
@@ -1,15 +1,118 @@
 import asyncio
 import httpx
-from typing import Dict, Any, Optional, List
+import ijson
+import orjson
+from typing import Dict, Any, Optional, List, Tuple, AsyncIterator
 from datetime import datetime, timedelta
 from loguru import logger
 import base64
+import random
+import time
+import weakref
+from functools import wraps
+from itertools import chain
 
 from ...core.config import settings
 from ...core.exceptions import WooCommerceAPIException
 from ...core.cache import cache_service
 
 
+# Clients with an open connection pool, closed together on shutdown
+_open_clients: "weakref.WeakSet[WooCommerceAPIClient]" = weakref.WeakSet()
+
+
+# Cached API reads stay servable this long past freshness (refresh in progress or upstream down)
+STALE_GRACE_SECONDS = 3600
+REFRESH_LOCK_SECONDS = 10
+
+MAX_BACKOFF_SECONDS = 30
+
+
+def _cache_entry(value: Any, ttl: int, etag: Optional[str] = None) -> Dict[str, Any]:
+    """Wrap value with its ETag and a jittered freshness deadline"""
+    jitter = int(ttl * 0.1)
+    return {'value': value, 'etag': etag, 'fresh_until': time.time() + ttl + random.randint(-jitter, jitter)}
+
+
+# (min_ttl, max_ttl) seconds per read endpoint; slow-moving store config is cached longest
+CACHE_POLICIES = {
+    "system_status": (60, 300),
+    "taxes": (300, 600),
+    "shipping/zones": (300, 600),
+    "products/categories": (120, 300),
+    "coupons": (60, 180),
+    "reports/sales": (60, 180),
+    "reports/top_sellers": (60, 180),
+}
+CACHE_TTL_BUFFER = 5
+
+
+def cached(policy: str):
+    """Cache a read method's result per store and arguments, with a TTL from CACHE_POLICIES"""
+    min_ttl, max_ttl = CACHE_POLICIES[policy]
+    
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            cache_key = f"woocommerce_{func.__name__}:{self.store_url}:{args}:{sorted(kwargs.items())}"
+            cached_value = await cache_service.get(cache_key)
+            if cached_value is not None:
+                return cached_value
+            
+            started = time.monotonic()
+            value = await func(self, *args, **kwargs)
+            
+            # Responses that are slow to generate are kept longer, within the policy bounds
+            gen_time = time.monotonic() - started
+            ttl = int(min(max_ttl, max(min_ttl, min_ttl + gen_time + CACHE_TTL_BUFFER)))
+            await cache_service.cache_with_jitter(cache_key, value, ttl)
+            return value
+        return wrapper
+    return decorator
+
+
+class _AsyncByteReader:
+    """Async file-like view over an httpx byte stream, as ijson's async parsers expect"""
+    
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b""
+    
+    async def read(self, size: int = -1) -> bytes:
+        if size == 0:
+            return b""
+        while not self._buffer:
+            chunk = await anext(self._chunks, None)
+            if chunk is None:
+                return b""
+            self._buffer = chunk
+        if size < 0 or size >= len(self._buffer):
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class _LocalTokenBucket:
+    """In-process token bucket; try_acquire never awaits, so it is atomic under asyncio"""
+    __slots__ = ('capacity', 'rate', 'tokens', 'last')
+    
+    def __init__(self, capacity: float, window: float):
+        self.capacity = capacity
+        self.rate = capacity / window
+        self.tokens = capacity
+        self.last = time.monotonic()
+    
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
 class WooCommerceAPIClient:
     """WooCommerce REST API client with authentication and rate limiting"""
     
@@ -17,21 +120,59 @@ class WooCommerceAPIClient:
         self.store_url = store_url.rstrip('/')
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
+        self._auth_header = "Basic " + base64.b64encode(f"{consumer_key}:{consumer_secret}".encode()).decode()
         self.api_base = f"{self.store_url}/wp-json/wc/v3"
         
         # Rate limiting settings (WooCommerce doesn't have strict limits but be respectful)
         self.rate_limit_calls = 60  # 60 requests per minute
         self.rate_limit_window = 60
         
+        # Half the limit is split into per-worker local shares, granted without Redis; the
+        # shared Redis bucket holds only the remainder, so the two never add up past the limit
+        local_share = self.rate_limit_calls // (2 * settings.web_concurrency)
+        self._local_bucket = _LocalTokenBucket(local_share, self.rate_limit_window)
+        self._shared_rate_limit_calls = self.rate_limit_calls - local_share * settings.web_concurrency
+        
         # Retry settings
         self.max_retries = 3
         self.backoff_factor = 2
+        
+        # Pooled keep-alive connection to the store, opened on first request
+        self._client: Optional[httpx.AsyncClient] = None
+        self.http2 = settings.woocommerce_http2 and self.store_url not in {
+            url.rstrip('/') for url in settings.woocommerce_http1_stores
+        }
+        
+        # Bounds fan-out of bulk fetches so they don't exhaust the pool
+        self._fetch_semaphore = asyncio.Semaphore(10)
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Get this store's pooled HTTP client, creating it on first use"""
+        if self._client is None or self._client.is_closed:
+            # With HTTP/2 concurrent calls multiplex over a few connections instead of queueing for one each
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                base_url=f"{self.api_base}/",
+                headers={
+                    'Authorization': self._auth_header,
+                    'Content-Type': 'application/json',
+                    'User-Agent': f'ECommerce-Bot/{settings.version}'
+                },
+                timeout=30.0,
+                limits=(
+                    httpx.Limits(max_keepalive_connections=4, max_connections=8, keepalive_expiry=60) if self.http2
+                    else httpx.Limits(max_keepalive_connections=20, max_connections=100, keepalive_expiry=30)
+                )
+            )
+            _open_clients.add(self)
+        return self._client
     
-    def _get_auth_header(self) -> str:
-        """Generate basic authentication header"""
-        credentials = f"{self.consumer_key}:{self.consumer_secret}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
-        return f"Basic {encoded_credentials}"
+    async def aclose(self):
+        """Close this store's connection pool"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        _open_clients.discard(self)
     
     async def _make_request(
         self,
@@ -39,103 +180,201 @@ class WooCommerceAPIClient:
         endpoint: str,
         params: Dict = None,
         data: Dict = None,
-        retry_count: int = 0
+        etag: Optional[str] = None
     ) -> httpx.Response:
         """Make API request with rate limiting and retry logic"""
         
         # Check rate limit
         await self._check_rate_limit()
         
-        url = f"{self.api_base}/{endpoint.lstrip('/')}"
-        headers = {
-            'Authorization': self._get_auth_header(),
-            'Content-Type': 'application/json',
-            'User-Agent': f'ECommerce-Bot/{settings.version}'
-        }
-        
-        try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.request(
+        headers = {'If-None-Match': etag} if etag else None
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                # httpx joins endpoint onto base_url, dropping its leading slash
+                response = await self._get_client().request(
                     method=method,
-                    url=url,
-                    headers=headers,
+                    url=endpoint,
                     params=params,
-                    json=data
+                    json=data,
+                    headers=headers
                 )
-                
-                # Handle rate limiting (429) and server errors (5xx)
-                if response.status_code == 429:
-                    retry_after = int(response.headers.get('Retry-After', 60))
-                    logger.warning(f"Rate limited by WooCommerce. Waiting {retry_after} seconds...")
-                    await asyncio.sleep(retry_after)
-                    if retry_count < self.max_retries:
-                        return await self._make_request(method, endpoint, params, data, retry_count + 1)
-                    else:
-                        raise WooCommerceAPIException("Rate limit exceeded, max retries reached")
-                
-                elif response.status_code >= 500:
-                    if retry_count < self.max_retries:
-                        wait_time = self.backoff_factor ** retry_count
-                        logger.warning(f"Server error {response.status_code}. Retrying in {wait_time} seconds...")
-                        await asyncio.sleep(wait_time)
-                        return await self._make_request(method, endpoint, params, data, retry_count + 1)
-                    else:
-                        raise WooCommerceAPIException(f"Server error {response.status_code}, max retries reached")
-                
-                elif response.status_code >= 400:
-                    try:
-                        error_data = response.json()
-                        error_message = error_data.get('message', f'HTTP {response.status_code}')
-                    except:
-                        error_message = f'HTTP {response.status_code}'
-                    raise WooCommerceAPIException(f"API error: {error_message}")
-                
-                # Update rate limit tracking
-                await self._update_rate_limit()
-                
+            except httpx.RequestError as e:
+                if last_attempt:
+                    raise WooCommerceAPIException(f"Network error: {str(e)}")
+                wait_time = self._backoff(attempt)
+                logger.warning(f"Network error: {e}. Retrying in {wait_time:.1f} seconds...")
+                await asyncio.sleep(wait_time)
+                continue
+            
+            status_code = response.status_code
+            if status_code < 300:
                 return response
-                
-        except httpx.RequestError as e:
-            if retry_count < self.max_retries:
-                wait_time = self.backoff_factor ** retry_count
-                logger.warning(f"Network error: {e}. Retrying in {wait_time} seconds...")
+            
+            # Handle rate limiting (429) and server errors (5xx)
+            bucket = status_code // 100
+            if status_code == 429:
+                if last_attempt:
+                    raise WooCommerceAPIException("Rate limit exceeded, max retries reached")
+                retry_after = int(response.headers.get('Retry-After', 60)) + random.uniform(0, 1)
+                logger.warning(f"Rate limited by WooCommerce. Waiting {retry_after:.1f} seconds...")
+                await asyncio.sleep(retry_after)
+                continue
+            
+            elif bucket == 5:
+                if last_attempt:
+                    raise WooCommerceAPIException(f"Server error {status_code}, max retries reached")
+                wait_time = self._backoff(attempt)
+                logger.warning(f"Server error {status_code}. Retrying in {wait_time:.1f} seconds...")
                 await asyncio.sleep(wait_time)
-                return await self._make_request(method, endpoint, params, data, retry_count + 1)
-            else:
-                raise WooCommerceAPIException(f"Network error: {str(e)}")
+                continue
+            
+            elif bucket == 4:
+                try:
+                    error_data = orjson.loads(response.content)
+                    error_message = error_data.get('message', f'HTTP {status_code}')
+                except (orjson.JSONDecodeError, AttributeError):
+                    error_message = f'HTTP {status_code}'
+                raise WooCommerceAPIException(f"API error: {error_message}", status_code=status_code)
+            
+            # 3xx (e.g. 304 Not Modified on revalidation)
+            return response
+        
+        raise WooCommerceAPIException("Max retries reached")
+    
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff, so clients failing together don't retry in lockstep"""
+        return random.uniform(0, min(MAX_BACKOFF_SECONDS, self.backoff_factor * (2 ** attempt)))
     
     async def _check_rate_limit(self):
-        """Check if we're within rate limits"""
+        """Wait until the local or the store's shared token bucket grants a request"""
+        if self._local_bucket.try_acquire():
+            return
+        
         rate_key = f"woocommerce_rate_limit:{self.store_url}"
-        current_requests = await cache_service.get(rate_key) or 0
+        while True:
+            allowed, retry_after_ms = await cache_service.eval_rate_script(
+                rate_key, self._shared_rate_limit_calls, self.rate_limit_window
+            )
+            if allowed:
+                return
+            
+            logger.info(f"Rate limit reached for {self.store_url}. Waiting {retry_after_ms} ms...")
+            await asyncio.sleep(retry_after_ms / 1000)
+    
+    def _resource_key(self, kind: str, resource_id: Any) -> str:
+        """Cache key for a single resource's {value, etag, fresh_until} entry"""
+        return f"woocommerce:v2:{kind}:{self.store_url}:{resource_id}"
+    
+    async def _get_cached(self, cache_key: str, endpoint: str, ttl: int) -> Optional[Dict[str, Any]]:
+        """Get a resource through the cache, serving stale copies while refreshing or on upstream errors"""
+        entry = await cache_service.get(cache_key)
+        if entry:
+            if time.time() < entry['fresh_until']:
+                return entry['value']
+            
+            # Stale: only the lock winner refreshes, everyone else keeps serving the old copy
+            if not await cache_service.acquire_lock(f"lock:{cache_key}", REFRESH_LOCK_SECONDS):
+                return entry['value']
+        
+        try:
+            fresh = await self._fetch_entry(endpoint, ttl, entry)
+        except WooCommerceAPIException as e:
+            if e.status_code == 404:
+                await cache_service.delete(cache_key)
+            if not entry or e.status_code < 500:
+                return None
+            # Upstream or network failure: keep the stale copy around for another grace period
+            await cache_service.set(cache_key, entry, STALE_GRACE_SECONDS)
+            return entry['value']
         
-        if current_requests >= self.rate_limit_calls:
-            wait_time = self.rate_limit_window
-            logger.info(f"Rate limit reached for {self.store_url}. Waiting {wait_time} seconds...")
-            await asyncio.sleep(wait_time)
+        await cache_service.set(cache_key, fresh, ttl + STALE_GRACE_SECONDS)
+        return fresh['value']
     
-    async def _update_rate_limit(self):
-        """Update rate limit counter"""
-        rate_key = f"woocommerce_rate_limit:{self.store_url}"
-        await cache_service.increment(rate_key)
-        # Set expiry if it's a new key
-        if not await cache_service.exists(rate_key):
-            await cache_service.set_with_expire(rate_key, 1, self.rate_limit_window)
+    async def _fetch_entry(
+        self,
+        endpoint: str,
+        ttl: int,
+        entry: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Fetch a resource as a cache entry, revalidating the stale entry's ETag if it has one"""
+        etag = entry.get('etag') if entry else None
+        response = await self._make_request('GET', endpoint, etag=etag)
+        if response.status_code == 304:
+            # Not modified: keep the cached body, no download or parse
+            return _cache_entry(entry['value'], ttl, etag)
+        return _cache_entry(orjson.loads(response.content), ttl, response.headers.get('ETag'))
+    
+    async def _get_bulk(
+        self,
+        kind: str,
+        endpoint: str,
+        ids: List[str],
+        ttl: int
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Get resources by ID with one MGET, fetching only the misses concurrently"""
+        unique_ids = list(dict.fromkeys(str(i) for i in ids))
+        cache_keys = [self._resource_key(kind, i) for i in unique_ids]
+        cached_entries = await cache_service.mget(cache_keys)
+        
+        now = time.time()
+        stored = dict(zip(unique_ids, cached_entries))
+        results = {i: entry['value'] if entry else None for i, entry in stored.items()}
+        misses = [i for i, entry in stored.items() if not entry or now >= entry['fresh_until']]
+        if not misses:
+            return results
+        
+        async def _one(resource_id: str) -> Dict[str, Any]:
+            async with self._fetch_semaphore:
+                return await self._fetch_entry(f'{endpoint}/{resource_id}', ttl, stored[resource_id])
+        
+        fetched = await asyncio.gather(*[_one(i) for i in misses], return_exceptions=True)
+        
+        # Cache all fetched resources in a single pipeline; upstream failures keep serving stale copies
+        entries = {}
+        deleted = []
+        for resource_id, entry in zip(misses, fetched):
+            if isinstance(entry, WooCommerceAPIException):
+                if entry.status_code < 500 or not stored[resource_id]:
+                    results[resource_id] = None
+                if entry.status_code == 404:
+                    deleted.append(self._resource_key(kind, resource_id))
+            elif isinstance(entry, BaseException):
+                raise entry
+            else:
+                results[resource_id] = entry['value']
+                entries[self._resource_key(kind, resource_id)] = entry
+        await cache_service.mset(entries, ttl + STALE_GRACE_SECONDS)
+        for cache_key in deleted:
+            await cache_service.delete(cache_key)
+        return results
+    
+    async def stream_items(self, endpoint: str, params: Dict = None) -> AsyncIterator[Dict[str, Any]]:
+        """Stream the items of a JSON list endpoint one at a time, without buffering the body"""
+        await self._check_rate_limit()
+        
+        async with self._get_client().stream('GET', endpoint, params=params) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                raise WooCommerceAPIException(f"API error: HTTP {response.status_code}")
+            
+            async for item in ijson.items_async(_AsyncByteReader(response.aiter_bytes()), 'item', use_float=True):
+                yield item
     
     async def get(self, endpoint: str, params: Dict = None) -> Any:
         """GET request"""
         response = await self._make_request('GET', endpoint, params=params)
-        return response.json()
+        return orjson.loads(response.content)
     
     async def post(self, endpoint: str, data: Dict = None) -> Any:
         """POST request"""
         response = await self._make_request('POST', endpoint, data=data)
-        return response.json()
+        return orjson.loads(response.content)
     
     async def put(self, endpoint: str, data: Dict = None) -> Any:
         """PUT request"""
         response = await self._make_request('PUT', endpoint, data=data)
-        return response.json()
+        return orjson.loads(response.content)
     
     async def delete(self, endpoint: str) -> bool:
         """DELETE request"""
@@ -143,6 +382,7 @@ class WooCommerceAPIClient:
         return response.status_code == 200
     
     # System information
+    @cached("system_status")
     async def get_system_status(self) -> Dict[str, Any]:
         """Get WooCommerce system status"""
         return await self.get('/system_status')
@@ -150,22 +390,10 @@ class WooCommerceAPIClient:
     # Order methods
     async def get_order(self, order_id: str) -> Optional[Dict[str, Any]]:
         """Get order by ID"""
-        cache_key = f"woocommerce_order:{self.store_url}:{order_id}"
+        cache_key = self._resource_key('order', order_id)
         
-        # Try cache first
-        cached_order = await cache_service.get(cache_key)
-        if cached_order:
-            return cached_order
-        
-        try:
-            order = await self.get(f'/orders/{order_id}')
-            
-            # Cache for 5 minutes
-            await cache_service.cache_with_jitter(cache_key, order, cache_service.TTL_ORDER_CACHE)
-            
-            return order
-        except WooCommerceAPIException:
-            return None
+        # Fresh for 5 minutes
+        return await self._get_cached(cache_key, f'/orders/{order_id}', cache_service.TTL_ORDER_CACHE)
     
     async def get_orders(
         self,
@@ -179,11 +407,39 @@ class WooCommerceAPIClient:
         per_page: int = 50
     ) -> List[Dict[str, Any]]:
         """Get orders with filters"""
-        params = {
-            'page': page,
-            'per_page': min(per_page, 100),  # Max 100 per request
-            'dp': dp
-        }
+        params = self._order_params(status, customer, product, dp, after, before)
+        params['page'] = page
+        params['per_page'] = min(per_page, 100)  # Max 100 per request
+        
+        return await self.get('/orders', params)
+    
+    async def iter_orders(self, per_page: int = 100, **filters) -> AsyncIterator[Dict[str, Any]]:
+        """Iterate over all matching orders page by page, decoding one order at a time"""
+        params = self._order_params(**filters)
+        params['per_page'] = min(per_page, 100)
+        
+        page = 1
+        while True:
+            params['page'] = page
+            count = 0
+            async for order in self.stream_items('/orders', params):
+                count += 1
+                yield order
+            if count < params['per_page']:
+                return
+            page += 1
+    
+    @staticmethod
+    def _order_params(
+        status: str = None,
+        customer: int = None,
+        product: int = None,
+        dp: int = 2,  # decimal places
+        after: datetime = None,
+        before: datetime = None
+    ) -> Dict[str, Any]:
+        """Build order list query parameters from filters"""
+        params = {'dp': dp}
         
         if status:
             params['status'] = status
@@ -196,14 +452,27 @@ class WooCommerceAPIClient:
         if before:
             params['before'] = before.isoformat()
         
-        return await self.get('/orders', params)
+        return params
+    
+    async def get_orders_bulk(self, order_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Get several orders by ID"""
+        return await self._get_bulk('order', '/orders', order_ids, cache_service.TTL_ORDER_CACHE)
+    
+    async def get_orders_pages(self, pages: range, **filters) -> List[Dict[str, Any]]:
+        """Get several pages of orders concurrently, concatenated in page order"""
+        async def _one(page: int) -> List[Dict[str, Any]]:
+            async with self._fetch_semaphore:
+                return await self.get_orders(page=page, **filters)
+        
+        results = await asyncio.gather(*[_one(page) for page in pages])
+        return list(chain.from_iterable(results))
     
     async def update_order(self, order_id: str, order_data: Dict[str, Any]) -> Dict[str, Any]:
         """Update order"""
         order = await self.put(f'/orders/{order_id}', order_data)
         
         # Invalidate cache
-        cache_key = f"woocommerce_order:{self.store_url}:{order_id}"
+        cache_key = self._resource_key('order', order_id)
         await cache_service.delete(cache_key)
         
         return order
@@ -223,22 +492,14 @@ class WooCommerceAPIClient:
     # Customer methods
     async def get_customer(self, customer_id: str) -> Optional[Dict[str, Any]]:
         """Get customer by ID"""
-        cache_key = f"woocommerce_customer:{self.store_url}:{customer_id}"
-        
-        # Try cache first
-        cached_customer = await cache_service.get(cache_key)
-        if cached_customer:
-            return cached_customer
+        cache_key = self._resource_key('customer', customer_id)
         
-        try:
-            customer = await self.get(f'/customers/{customer_id}')
-            
-            # Cache for 10 minutes
-            await cache_service.cache_with_jitter(cache_key, customer, cache_service.TTL_ORDER_CACHE * 2)
-            
-            return customer
-        except WooCommerceAPIException:
-            return None
+        # Fresh for 10 minutes
+        return await self._get_cached(cache_key, f'/customers/{customer_id}', cache_service.TTL_ORDER_CACHE * 2)
+    
+    async def get_customers_bulk(self, customer_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Get several customers by ID"""
+        return await self._get_bulk('customer', '/customers', customer_ids, cache_service.TTL_ORDER_CACHE * 2)
     
     async def get_customers(
         self,
@@ -268,7 +529,7 @@ class WooCommerceAPIClient:
         customer = await self.put(f'/customers/{customer_id}', customer_data)
         
         # Invalidate cache
-        cache_key = f"woocommerce_customer:{self.store_url}:{customer_id}"
+        cache_key = self._resource_key('customer', customer_id)
         await cache_service.delete(cache_key)
         
         return customer
@@ -276,22 +537,14 @@ class WooCommerceAPIClient:
     # Product methods
     async def get_product(self, product_id: str) -> Optional[Dict[str, Any]]:
         """Get product by ID"""
-        cache_key = f"woocommerce_product:{self.store_url}:{product_id}"
-        
-        # Try cache first
-        cached_product = await cache_service.get(cache_key)
-        if cached_product:
-            return cached_product
+        cache_key = self._resource_key('product', product_id)
         
-        try:
-            product = await self.get(f'/products/{product_id}')
-            
-            # Cache for 30 minutes (products change less frequently)
-            await cache_service.cache_with_jitter(cache_key, product, cache_service.TTL_SHORT * 30)
-            
-            return product
-        except WooCommerceAPIException:
-            return None
+        # Fresh for 30 minutes (products change less frequently)
+        return await self._get_cached(cache_key, f'/products/{product_id}', cache_service.TTL_SHORT * 30)
+    
+    async def get_products_bulk(self, product_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Get several products by ID"""
+        return await self._get_bulk('product', '/products', product_ids, cache_service.TTL_SHORT * 30)
     
     async def get_products(
         self,
@@ -319,6 +572,7 @@ class WooCommerceAPIClient:
         return await self.get('/products', params)
     
     # Category methods
+    @cached("products/categories")
     async def get_product_categories(self, page: int = 1, per_page: int = 50) -> List[Dict[str, Any]]:
         """Get product categories"""
         params = {
@@ -328,20 +582,24 @@ class WooCommerceAPIClient:
         return await self.get('/products/categories', params)
     
     # Tax methods
+    @cached("taxes")
     async def get_tax_rates(self) -> List[Dict[str, Any]]:
         """Get tax rates"""
         return await self.get('/taxes')
     
     # Shipping methods
+    @cached("shipping/zones")
     async def get_shipping_zones(self) -> List[Dict[str, Any]]:
         """Get shipping zones"""
         return await self.get('/shipping/zones')
     
+    @cached("shipping/zones")
     async def get_shipping_methods(self, zone_id: str) -> List[Dict[str, Any]]:
         """Get shipping methods for a zone"""
         return await self.get(f'/shipping/zones/{zone_id}/methods')
     
     # Coupon methods
+    @cached("coupons")
     async def get_coupons(self, code: str = None, page: int = 1, per_page: int = 50) -> List[Dict[str, Any]]:
         """Get coupons"""
         params = {
@@ -377,24 +635,47 @@ class WooCommerceAPIClient:
         return await self.delete(f'/webhooks/{webhook_id}')
     
     # Reports methods
+    @cached("reports/sales")
     async def get_sales_report(self, period: str = 'week') -> Dict[str, Any]:
         """Get sales report"""
         params = {'period': period}
         return await self.get('/reports/sales', params)
     
+    @cached("reports/top_sellers")
     async def get_top_sellers_report(self, period: str = 'week') -> List[Dict[str, Any]]:
         """Get top sellers report"""
         params = {'period': period}
         return await self.get('/reports/top_sellers', params)
 
 
+# API clients shared across requests, keyed by (store_url, consumer_key, consumer_secret)
+_api_clients: Dict[Tuple[str, str, str], WooCommerceAPIClient] = {}
+_MAX_API_CLIENTS = 256
+
+
 def get_woocommerce_client(merchant) -> WooCommerceAPIClient:
-    """Factory function to create WooCommerce client for merchant"""
+    """Get the shared WooCommerce client for merchant, creating it on first use"""
     if not merchant.woocommerce_consumer_key or not merchant.woocommerce_consumer_secret or not merchant.woocommerce_url:
         raise WooCommerceAPIException("Missing WooCommerce credentials for merchant")
     
-    return WooCommerceAPIClient(
-        store_url=merchant.woocommerce_url,
-        consumer_key=merchant.woocommerce_consumer_key,
-        consumer_secret=merchant.woocommerce_consumer_secret
-    )
\ No newline at end of file
+    # No await between lookup and insert, so concurrent first requests can't create duplicates
+    key = (merchant.woocommerce_url, merchant.woocommerce_consumer_key, merchant.woocommerce_consumer_secret)
+    client = _api_clients.get(key)
+    if client is None:
+        if len(_api_clients) >= _MAX_API_CLIENTS:
+            # Evict the oldest entry (e.g. rotated credentials). Requests may still hold it, so its
+            # pool is not closed here: idle connections expire and the client is garbage-collected
+            _api_clients.pop(next(iter(_api_clients)))
+        client = _api_clients[key] = WooCommerceAPIClient(
+            store_url=merchant.woocommerce_url,
+            consumer_key=merchant.woocommerce_consumer_key,
+            consumer_secret=merchant.woocommerce_consumer_secret
+        )
+    return client
+
+
+async def close_woocommerce_clients():
+    """Close every open WooCommerce connection pool (app shutdown)"""
+    _api_clients.clear()
+    for client in list(_open_clients):
+        await client.aclose()
@@ -2,6 +2,8 @@ from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from loguru import logger
+from datetime import datetime
+import asyncio
 import sys
 
 from .core.config import settings
@@ -14,7 +16,8 @@ from .core.middleware import (
     CorrelationIDMiddleware,
     RequestLoggingMiddleware,
     RateLimitMiddleware,
-    SecurityHeadersMiddleware
+    SecurityHeadersMiddleware,
+    RequestCoalesceMiddleware
 )
 
 
@@ -39,10 +42,37 @@ async def lifespan(app: FastAPI):
     else:
         logger.error("Database connection failed")
     
+    # Check the cache backend
+    from .core.cache import cache_service
+    if await cache_service.health_check():
+        logger.info("Cache connection successful")
+    else:
+        logger.error("Cache connection failed; set CACHE_BACKEND=memory to run without Redis")
+    
+    # Open the shared Shopify HTTP/2 connection pool
+    from .integrations.shopify.client import get_http_client
+    get_http_client()
+    
+    # Without Redis the queue lives in this process, so its workers have to as well
+    worker_task = None
+    if settings.cache_backend == "memory":
+        from .worker import run_workers
+        worker_task = asyncio.create_task(run_workers())
+    
     yield
     
     # Shutdown
     logger.info("Shutting down E-Commerce Support Bot API")
+    
+    if worker_task is not None:
+        worker_task.cancel()
+        await asyncio.gather(worker_task, return_exceptions=True)
+    
+    from .integrations.shopify.client import close_http_client
+    await close_http_client()
+    
+    from .integrations.woocommerce.client import close_woocommerce_clients
+    await close_woocommerce_clients()
 
 
 app = FastAPI(
@@ -54,6 +84,7 @@ app = FastAPI(
 )
 
 # Add middleware (order matters!)
+app.add_middleware(RequestCoalesceMiddleware)
 app.add_middleware(SecurityHeadersMiddleware)
 app.add_middleware(RateLimitMiddleware)
 app.add_middleware(RequestLoggingMiddleware)
@@ -92,27 +123,27 @@ async def root():
 @app.get("/health")
 async def health_check():
     from .core.database import check_database_connection
+    from .core.cache import cache_service
     
-    health_status = {
-        "status": "healthy",
-        "timestamp": "2023-01-01T00:00:00Z",
+    # Run dependency checks concurrently; a check that raises counts as unhealthy
+    database_ok, redis_ok = await asyncio.gather(
+        check_database_connection(),
+        cache_service.health_check(),
+        return_exceptions=True
+    )
+    checks = {
+        "database": database_ok is True,
+        "redis": redis_ok is True,
+        "external_apis": True  # Will implement external API checks
+    }
+    
+    return {
+        "status": "healthy" if all(checks.values()) else "unhealthy",
+        "timestamp": datetime.utcnow().isoformat(),
         "version": settings.version,
         "environment": settings.environment,
-        "checks": {
-            "database": await check_database_connection(),
-            "redis": True,  # Will implement Redis check
-            "external_apis": True  # Will implement external API checks
-        }
+        "checks": checks
     }
-    
-    # Overall health status
-    all_healthy = all(health_status["checks"].values())
-    health_status["status"] = "healthy" if all_healthy else "unhealthy"
-    
-    from datetime import datetime
-    health_status["timestamp"] = datetime.utcnow().isoformat()
-    
-    return health_status
 
 
 if __name__ == "__main__":
@@ -121,5 +152,7 @@ if __name__ == "__main__":
         "src.main:app",
         host=settings.host,
         port=settings.port,
-        reload=settings.debug
+        reload=settings.debug,
+        loop="uvloop",
+        http="httptools"
     )
\ No newline at end of file
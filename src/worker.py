@@ -0,0 +1,23 @@
+"""Queue worker entrypoint: python -m src.worker [queue_name ...]"""
+import asyncio
+import sys
+from typing import Sequence
+
+from .core.queue import async_queue
+from .integrations.shopify.webhooks import WEBHOOK_QUEUE_HIGH, WEBHOOK_QUEUE_NORMAL
+
+
+# Partitions consumed when no queue names are given
+DEFAULT_QUEUES = (WEBHOOK_QUEUE_HIGH, WEBHOOK_QUEUE_NORMAL)
+
+
+async def run_workers(queue_names: Sequence[str] = DEFAULT_QUEUES):
+    """Run one worker loop per queue partition until stopped"""
+    try:
+        await asyncio.gather(*(async_queue.start_worker(name) for name in queue_names))
+    finally:
+        await async_queue.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_workers(tuple(sys.argv[1:]) or DEFAULT_QUEUES))
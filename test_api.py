@@ -9,6 +9,7 @@ import uvicorn
 import subprocess
 import sys
 import os
+from importlib.metadata import distributions
 from pathlib import Path
 
 # Add src to Python path
@@ -21,12 +22,13 @@ def check_dependencies():
         "pydantic", "pydantic-settings"
     ]
     
-    missing = []
-    for package in required_packages:
-        try:
-            __import__(package)
-        except ImportError:
-            missing.append(package)
+    # Scan installed distributions instead of importing each package
+    installed = {
+        dist.metadata["Name"].lower().replace("_", "-")
+        for dist in distributions()
+        if dist.metadata["Name"]
+    }
+    missing = [package for package in required_packages if package.lower() not in installed]
     
     if missing:
         print(f"❌ Eksik paketler: {', '.join(missing)}")
@@ -48,8 +50,9 @@ LOG_LEVEL=INFO
 # Database (SQLite for testing)
 DATABASE_URL=sqlite:///./test.db
 
-# Redis (disabled for testing)
+# Redis (disabled for testing, cache runs in-process)
 REDIS_URL=redis://localhost:6379/0
+CACHE_BACKEND=memory
 
 # API Keys (mock values for testing)
 OPENAI_API_KEY=test-key
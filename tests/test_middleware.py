@@ -0,0 +1,80 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request, Response
+
+from src.core.middleware import RequestCoalesceMiddleware
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+@pytest.fixture
+def client(calls):
+    app = FastAPI()
+    app.add_middleware(RequestCoalesceMiddleware)
+    
+    @app.post("/shopify/webhooks/orders_create")
+    async def webhook(request: Request):
+        calls.append(request.headers["x-shopify-hmac-sha256"])
+        await asyncio.sleep(0.05)
+        response = Response(status_code=202 if request.headers["x-shopify-hmac-sha256"] == "genuine" else 401)
+        response.set_cookie("a", "1")
+        response.set_cookie("b", "2")
+        return response
+    
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def post_webhook(client: httpx.AsyncClient, signature: str):
+    return client.post("/shopify/webhooks/orders_create", content=b"{}", headers={
+        "X-Shopify-Shop-Domain": "coalesce.myshopify.com",
+        "X-Shopify-Webhook-Id": "webhook-1",
+        "X-Shopify-Hmac-SHA256": signature,
+    })
+
+
+@pytest.mark.asyncio
+async def test_identical_deliveries_share_one_response(client, calls):
+    first, second = await asyncio.gather(post_webhook(client, "genuine"), post_webhook(client, "genuine"))
+    
+    assert calls == ["genuine"]
+    assert first.status_code == second.status_code == 202
+    assert second.headers.get_list("set-cookie") == first.headers.get_list("set-cookie")
+    assert len(second.headers.get_list("set-cookie")) == 2
+
+
+@pytest.mark.asyncio
+async def test_forged_delivery_is_not_coalesced(client, calls):
+    forged, genuine = await asyncio.gather(post_webhook(client, "forged"), post_webhook(client, "genuine"))
+    
+    assert sorted(calls) == ["forged", "genuine"]
+    assert forged.status_code == 401
+    assert genuine.status_code == 202
+
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_releases_duplicates():
+    middleware = RequestCoalesceMiddleware(FastAPI())
+    started = asyncio.Event()
+    
+    async def call_next(request):
+        started.set()
+        await asyncio.sleep(10)
+    
+    scope = {
+        "type": "http", "method": "POST", "path": "/shopify/webhooks/orders_create", "query_string": b"",
+        "headers": [(b"x-shopify-webhook-id", b"webhook-2"), (b"x-shopify-hmac-sha256", b"genuine")],
+    }
+    leader = asyncio.create_task(middleware.dispatch(Request(scope), call_next))
+    await started.wait()
+    follower = asyncio.create_task(middleware.dispatch(Request(scope), call_next))
+    await asyncio.sleep(0)
+    leader.cancel()
+    
+    with pytest.raises(RuntimeError):
+        await follower
+    assert middleware._in_flight == {}
@@ -0,0 +1,109 @@
+import base64
+import hashlib
+import hmac
+
+import httpx
+import orjson
+import pytest
+from fastapi import FastAPI
+
+from src.core.cache import cache_service
+from src.core.database import get_db
+from src.core.queue import async_queue
+from src.integrations.shopify.router import router
+from src.integrations.shopify.webhooks import WEBHOOK_QUEUE_HIGH
+
+
+class FakeSession:
+    """Session stand-in that finds no merchants and counts the queries it was asked to run"""
+    
+    def __init__(self):
+        self.queries = 0
+    
+    async def execute(self, statement):
+        self.queries += 1
+        return self
+    
+    def one_or_none(self):
+        return None
+
+
+@pytest.fixture
+def session():
+    return FakeSession()
+
+
+@pytest.fixture
+def client(session):
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_db] = lambda: session
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def sign(body: bytes, secret: str) -> str:
+    return base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+
+
+async def cache_merchant(shop: str, merchant_id: int, secret: str):
+    await cache_service.set_with_expire(f"shopify_merchant:{shop}", {"id": merchant_id, "secret": secret}, 60)
+
+
+def webhook_headers(shop: str, signature: str) -> dict:
+    return {
+        "X-Shopify-Shop-Domain": shop,
+        "X-Shopify-Hmac-SHA256": signature,
+        "X-Shopify-Webhook-Id": f"webhook-{shop}",
+        "X-Shopify-Topic": "orders/create",
+    }
+
+
+@pytest.mark.asyncio
+async def test_signed_webhook_is_queued_and_accepted(client, session):
+    shop = "accepted.myshopify.com"
+    await cache_merchant(shop, 41, "merchant-secret")
+    body = orjson.dumps({"id": 1001, "order_number": 1001})
+    
+    response = await client.post("/shopify/webhooks/orders_create", content=body,
+                                 headers=webhook_headers(shop, sign(body, "merchant-secret")))
+    
+    assert response.status_code == 202
+    assert session.queries == 0
+    task = await async_queue.dequeue(WEBHOOK_QUEUE_HIGH, timeout=1)
+    assert task.payload["merchant_id"] == 41
+    assert task.payload["data"] == {"id": 1001, "order_number": 1001}
+
+
+@pytest.mark.asyncio
+async def test_merchant_secret_takes_precedence(client):
+    shop = "own-secret.myshopify.com"
+    await cache_merchant(shop, 42, "merchant-secret")
+    body = b'{"id": 1002}'
+    
+    response = await client.post("/shopify/webhooks/orders_create", content=body,
+                                 headers=webhook_headers(shop, sign(body, "test-webhook-secret")))
+    
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("signature", ["", "not base64!", base64.b64encode(b"x" * 32).decode()])
+async def test_bad_signature_is_rejected(client, signature):
+    shop = "rejected.myshopify.com"
+    await cache_merchant(shop, 43, "merchant-secret")
+    
+    response = await client.post("/shopify/webhooks/orders_create", content=b'{"id": 1003}',
+                                 headers=webhook_headers(shop, signature))
+    
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_unknown_shop_is_looked_up_once(client, session):
+    headers = webhook_headers("unknown.myshopify.com", sign(b"{}", "forged-secret"))
+    
+    for _ in range(3):
+        response = await client.post("/shopify/webhooks/orders_create", content=b"{}", headers=headers)
+        assert response.status_code == 401
+    
+    assert session.queries == 1
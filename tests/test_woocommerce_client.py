@@ -0,0 +1,54 @@
+import httpx
+import orjson
+import pytest
+
+from src.integrations.woocommerce.client import WooCommerceAPIClient
+
+
+def make_client(handler) -> WooCommerceAPIClient:
+    """WooCommerce client whose requests are answered by handler"""
+    client = WooCommerceAPIClient("https://shop.example.com", "ck_test", "cs_test")
+    client._client = httpx.AsyncClient(
+        transport=httpx.MockTransport(handler),
+        base_url=f"{client.api_base}/"
+    )
+    return client
+
+
+class ChunkedStream(httpx.AsyncByteStream):
+    """Response body delivered in small chunks, as a slow store would send it"""
+    
+    def __init__(self, body: bytes, chunk_size: int):
+        self.body = body
+        self.chunk_size = chunk_size
+    
+    async def __aiter__(self):
+        for i in range(0, len(self.body), self.chunk_size):
+            yield self.body[i:i + self.chunk_size]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+async def test_iter_orders_streams_every_item(chunk_size):
+    orders = [{"id": i, "total": f"{i}.50", "line_items": [{"sku": f"SKU-{i}"}]} for i in range(1, 151)]
+    pages = {1: orders[:100], 2: orders[100:]}
+    requested = []
+    
+    def handler(request: httpx.Request) -> httpx.Response:
+        page = int(request.url.params["page"])
+        requested.append(page)
+        assert request.url.path == "/wp-json/wc/v3/orders"
+        return httpx.Response(200, stream=ChunkedStream(orjson.dumps(pages.get(page, [])), chunk_size))
+    
+    client = make_client(handler)
+    streamed = [order async for order in client.iter_orders(status="processing")]
+    
+    assert streamed == orders
+    assert requested == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_stream_items_empty_page():
+    client = make_client(lambda request: httpx.Response(200, content=b"[]"))
+    
+    assert [item async for item in client.stream_items("orders")] == []